@@ -0,0 +1,77 @@
+"""
+Give every embedded flashcard that has no id a compact, stable one.
+
+Cards created by create_course_concept and add_course_concept_content used to be stored
+without an id, so the per-card endpoints could not address them. Only the missing ids are
+written, by array position, so existing ids and every other field are untouched. The user's
+due queue is dropped so it is rebuilt with the new ids. Re-running the script is safe.
+
+Pause writes while backfilling.
+
+Usage:
+    python backfill_flashcard_ids.py [--clerk-id ID] [--dry-run]
+"""
+import argparse
+
+from helpers.due_queue import invalidate_due_queue
+from helpers.flashcards import new_card_id
+from helpers.indexes import ensure_indexes
+from helpers.mongo import courses_collection, record_write
+
+
+def missing_id_updates(user):
+    # $set paths for the cards without an id, keyed by their position in the document. The new
+    # ids are also set on the cards of `user`, so callers can go on using them.
+    update = {}
+    for course_index, course in enumerate(user.get('courses', [])):
+        for card_index, card in enumerate(course.get('flashcards') or []):
+            if not card.get('id'):
+                card['id'] = new_card_id()
+                update[f"courses.{course_index}.flashcards.{card_index}.id"] = card['id']
+        for concept_index, concept in enumerate(course.get('concepts') or []):
+            for card_index, card in enumerate(concept.get('concept_flashcards') or []):
+                if not card.get('id'):
+                    card['id'] = new_card_id()
+                    update[f"courses.{course_index}.concepts.{concept_index}.concept_flashcards.{card_index}.id"] = card['id']
+    return update
+
+
+def backfill_user(user, dry_run=False):
+    update = missing_id_updates(user)
+    if update and not dry_run:
+        courses_collection.update_one({"_id": user['_id']}, {"$set": update})
+        record_write(user['clerk_id'])
+        invalidate_due_queue(user['clerk_id'])
+    return len(update)
+
+
+def main():
+    parser = argparse.ArgumentParser(description=__doc__, formatter_class=argparse.RawDescriptionHelpFormatter)
+    parser.add_argument('--clerk-id', help="Only backfill this user")
+    parser.add_argument('--dry-run', action='store_true', help="Count the cards without writing anything")
+    args = parser.parse_args()
+
+    query = {"clerk_id": args.clerk_id} if args.clerk_id else {}
+    projection = {"clerk_id": 1, "courses.flashcards.id": 1, "courses.concepts.concept_flashcards.id": 1}
+    users = 0
+    cards = 0
+    for user in courses_collection.find(query, projection):
+        try:
+            backfilled = backfill_user(user, args.dry_run)
+        except Exception as e:
+            print(f"Error backfilling flashcard ids for clerk_id {user.get('clerk_id')}: {e}")
+            continue
+        users += 1
+        cards += backfilled
+        if backfilled:
+            print(f"{user.get('clerk_id')}: {backfilled} flashcards")
+
+    if not args.dry_run:
+        ensure_indexes()
+
+    action = "Would backfill" if args.dry_run else "Backfilled"
+    print(f"{action} ids for {cards} flashcards of {users} users")
+
+
+if __name__ == "__main__":
+    main()
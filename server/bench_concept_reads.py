@@ -0,0 +1,144 @@
+"""
+Compare the concept reads in helpers/mongo.py against the whole-document fetches they replaced.
+
+For each read, prints the bytes the server sent back and the median latency of the old
+find_one({"clerk_id": ...}) + Python loop against the projected query. The course read
+cache is turned off, so every run goes to the database.
+
+Usage:
+    python bench_concept_reads.py <clerk_id> [--runs N]
+"""
+import argparse
+import statistics
+import threading
+import time
+
+import bson
+from pymongo import monitoring
+
+from helpers import mongo
+from helpers.mongo import courses_collection, users_collection
+
+
+class ReplyBytes(monitoring.CommandListener):
+    def __init__(self):
+        self.total = 0
+        self._lock = threading.Lock()
+
+    def started(self, event):
+        pass
+
+    def succeeded(self, event):
+        with self._lock:
+            self.total += len(bson.encode(event.reply))
+
+    def failed(self, event):
+        pass
+
+
+reply_bytes = ReplyBytes()
+# Must be registered before helpers.db creates the client
+monitoring.register(reply_bytes)
+
+# Measure the queries themselves, not hits in the course read cache
+mongo.COURSE_CACHE_ENABLED = False
+
+
+def legacy_get_flashcards(clerk_id, course_name, concept_name):
+    user_courses = courses_collection.find_one({"clerk_id": clerk_id})
+    if user_courses and 'courses' in user_courses:
+        for course in user_courses['courses']:
+            if course['course_name'] == course_name:
+                for concept in course.get('concepts', []):
+                    if concept['concept_name'] == concept_name:
+                        return concept['concept_flashcards']
+    return None
+
+
+def legacy_get_mcqs(clerk_id, course_name, concept_name):
+    user_courses = courses_collection.find_one({"clerk_id": clerk_id})
+    user_profile = users_collection.find_one({"clerk_id": clerk_id})
+    is_premium = user_profile.get('premium', False)
+    for course in user_courses['courses']:
+        if course['course_name'] == course_name:
+            for concept in course.get('concepts', []):
+                if concept['concept_name'] == concept_name:
+                    if not is_premium:
+                        return concept['concept_multiple_choice_questions'][:3]
+                    return concept['concept_multiple_choice_questions']
+    return []
+
+
+def legacy_get_course_concepts(clerk_id, course_name):
+    concepts = courses_collection.find_one({"clerk_id": clerk_id, "courses.course_name": course_name})
+    if concepts and 'courses' in concepts:
+        for course in concepts['courses']:
+            if course['course_name'] == course_name and course.get('concepts'):
+                return course['concepts']
+    return []
+
+
+def legacy_get_card(clerk_id, course_name, card_id):
+    user_courses = courses_collection.find_one({"clerk_id": clerk_id, "courses.course_name": course_name})
+    for course in user_courses['courses']:
+        if course['course_name'] == course_name:
+            cards = list(course.get('flashcards', []))
+            for concept in course.get('concepts', []):
+                cards.extend(concept.get('concept_flashcards', []))
+            for card in cards:
+                if card.get('id') == card_id:
+                    return card
+    return None
+
+
+def measure(fn, args, runs):
+    latencies = []
+    bytes_before = reply_bytes.total
+    for _ in range(runs):
+        start = time.perf_counter()
+        fn(*args)
+        latencies.append((time.perf_counter() - start) * 1000)
+    return (reply_bytes.total - bytes_before) // runs, statistics.median(latencies)
+
+
+def pick_targets(clerk_id):
+    user = courses_collection.find_one({"clerk_id": clerk_id})
+    if not user:
+        raise SystemExit(f"No courses document found for clerk_id: {clerk_id}")
+
+    for course in user.get('courses', []):
+        for concept in course.get('concepts', []):
+            card_id = next((card['id'] for card in concept.get('concept_flashcards', []) if 'id' in card), None)
+            return course['course_name'], concept['concept_name'], card_id
+    raise SystemExit(f"User {clerk_id} has no concepts to benchmark")
+
+
+def main():
+    parser = argparse.ArgumentParser(description=__doc__, formatter_class=argparse.RawDescriptionHelpFormatter)
+    parser.add_argument('clerk_id')
+    parser.add_argument('--runs', type=int, default=20)
+    args = parser.parse_args()
+
+    course_name, concept_name, card_id = pick_targets(args.clerk_id)
+    print(f"course={course_name!r} concept={concept_name!r} card={card_id!r} runs={args.runs}\n")
+
+    comparisons = [
+        ('get_flashcards', legacy_get_flashcards, mongo.get_flashcards, (args.clerk_id, course_name, concept_name)),
+        ('get_mcqs', legacy_get_mcqs, mongo.get_mcqs, (args.clerk_id, course_name, concept_name)),
+        ('get_course_concepts', legacy_get_course_concepts, mongo.get_course_concepts, (args.clerk_id, course_name)),
+    ]
+    if card_id:
+        comparisons += [
+            ('get_times_seen', legacy_get_card, mongo.get_times_seen, (args.clerk_id, course_name, card_id)),
+            ('get_next_study_date', legacy_get_card, mongo.get_next_study_date, (args.clerk_id, course_name, card_id)),
+        ]
+
+    print(f"{'read':<22}{'before bytes':>14}{'after bytes':>14}{'before ms':>12}{'after ms':>12}")
+    for name, before_fn, after_fn, fn_args in comparisons:
+        before_bytes, before_ms = measure(before_fn, fn_args, args.runs)
+        after_bytes, after_ms = measure(after_fn, fn_args, args.runs)
+        print(f"{name:<22}{before_bytes:>14,}{after_bytes:>14,}{before_ms:>12.2f}{after_ms:>12.2f}")
+
+
+if __name__ == "__main__":
+    main()
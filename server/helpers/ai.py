@@ -1,47 +1,159 @@
 import os
+import copy
+import hashlib
 import json
+import time
+from concurrent.futures import ThreadPoolExecutor, TimeoutError as FuturesTimeoutError
 from typing import List
 import openai
 import datetime
 from pydantic import BaseModel
-from pymongo import MongoClient
-from .util import parse_mc_questions
-from .mongo import create_or_update_next_study_date, get_times_seen
-
-# MongoDB setup
-mongo_uri = os.getenv('MONGO_URI')
-client = MongoClient(mongo_uri)
-db = client['VeidaAI']
-courses_collection = db['courses']
-
+from .util import parse_mc_questions, PAGE_BREAK
+from .cache import LRUCache, LMDBCache
+from .jobs import ProcessThreadPool
 # Groq API setup
 openai_api_key = os.getenv('OPENAI_API_KEY')
 openai_client = openai.OpenAI(api_key=openai_api_key)
+MODEL = "gpt-4o-mini"
+
+# LLM response cache setup. Results are keyed by model, system prompt and a hash of the input
+# and kept in an in-process LRU, in front of an LMDB store when LLM_CACHE_PATH is set.
+LLM_CACHE_ENABLED = os.getenv('LLM_CACHE_ENABLED', 'true').lower() == 'true'
+LLM_CACHE_SIZE = int(os.getenv('LLM_CACHE_SIZE', '512'))
+LLM_CACHE_TTL_SECONDS = float(os.getenv('LLM_CACHE_TTL_SECONDS', str(7 * 24 * 3600)))
+LLM_CACHE_PATH = os.getenv('LLM_CACHE_PATH', '')
+
+llm_memory_cache = LRUCache(maxsize=LLM_CACHE_SIZE, ttl=LLM_CACHE_TTL_SECONDS)
+llm_disk_cache = LMDBCache(LLM_CACHE_PATH, ttl=LLM_CACHE_TTL_SECONDS) if LLM_CACHE_PATH else None
+
+# Concurrent generation setup
+GENERATION_WORKERS = int(os.getenv('GENERATION_WORKERS', '8'))
+GENERATION_TIMEOUT_SECONDS = float(os.getenv('GENERATION_TIMEOUT_SECONDS', '300'))
+
+_generation_executor = ProcessThreadPool(GENERATION_WORKERS, 'generation')
+
+
+NOTES_SYSTEM_PROMPT = (
+    "As the perfect consistent educator, your task is to transform the provided text into well-structured, detailed lecture notes without leaving out any subject matter."
+    "Omit all: course related information, administrative details, agendas, announcements, homework and other school related content."
+    "Ensure that every single new and relevant information, definition, term, concept, and formula related to the course are included."
+)
+
+MERGE_NOTES_SYSTEM_PROMPT = (
+    "You are given consecutive parts of lecture notes that were written separately from consecutive parts of the same document."
+    "Combine them into one set of well-structured, detailed lecture notes in the original order."
+    "Merge repeated headings and remove duplicated content, but do not leave out any subject matter, definition, term, concept, or formula."
+)
+
+# Chunked notes setup. Token counts are estimated from the character count.
+CHARS_PER_TOKEN = 4
+NOTES_CHUNK_TOKENS = int(os.getenv('NOTES_CHUNK_TOKENS', '12000'))
+NOTES_CONCURRENCY = int(os.getenv('NOTES_CONCURRENCY', '4'))
+NOTES_MERGE_MAX_TOKENS = int(os.getenv('NOTES_MERGE_MAX_TOKENS', '6000'))
+# Extra attempts for a chunk whose notes fail to generate, before the whole document fails
+NOTES_CHUNK_RETRIES = int(os.getenv('NOTES_CHUNK_RETRIES', '1'))
+
+NOTES_ERROR = 'Error generating notes.'
+
 
+def _llm_cache_key(model, system_prompt, user_content):
+    digest = hashlib.sha256()
+    for part in (model, system_prompt, user_content):
+        digest.update(part.encode('utf-8'))
+        digest.update(b'\0')
+    return digest.hexdigest()
 
-def generate_notes(extracted_text):
+
+def cached_generation(model, system_prompt, user_content, generate, use_cache=True):
     """
-    Generate notes using OpenAI API.
+    Return the cached result for a prompt, or call `generate` and cache what it returns.
+
+    Empty and error results are never cached. Callers receive their own copy of cached
+    values, since the routes add fields to the generated flashcards and MCQs.
+
+    Args:
+        model (str): The model the prompt is sent to.
+        system_prompt (str): The system prompt.
+        user_content (str): The user message.
+        generate (callable): Called with user_content on a miss.
+        use_cache (bool): False skips the cache lookup and regenerates; the new result is still cached.
+
+    Returns:
+        The generated or cached result.
+    """
+    if not LLM_CACHE_ENABLED or not user_content:
+        return generate(user_content)
+
+    key = _llm_cache_key(model, system_prompt, user_content)
+    if use_cache:
+        result = llm_memory_cache.get(key)
+        if result is None and llm_disk_cache is not None:
+            result = llm_disk_cache.get(key)
+            if result is not None:
+                llm_memory_cache.set(key, result)
+        if result is not None:
+            return copy.deepcopy(result)
+
+    result = generate(user_content)
+    if result and result != NOTES_ERROR:
+        llm_memory_cache.set(key, copy.deepcopy(result))
+        if llm_disk_cache is not None:
+            llm_disk_cache.set(key, result)
+    return result
+
+
+def estimate_tokens(text):
+    return len(text) // CHARS_PER_TOKEN + 1
+
+
+def chunk_extracted_text(extracted_text, max_tokens=NOTES_CHUNK_TOKENS):
+    """
+    Split extracted text into chunks of at most `max_tokens` estimated tokens.
+
+    Chunks are packed from whole pages and slides. A single page that is too large on its
+    own is split on line boundaries, and a single line that is too large is split by length.
 
-    This function generates notes from the provided text.
-    
     Args:
         extracted_text (str): The text extracted from the file.
+        max_tokens (int): The maximum estimated tokens per chunk.
 
     Returns:
-        str: Generated notes.
+        list: The text chunks, in document order.
     """
+    max_chars = max_tokens * CHARS_PER_TOKEN
+    if len(extracted_text) <= max_chars:
+        return [extracted_text]
+
+    pieces = []
+    for page in extracted_text.split(PAGE_BREAK):
+        page += PAGE_BREAK
+        if len(page) <= max_chars:
+            pieces.append(page)
+            continue
+        for line in page.splitlines(keepends=True):
+            pieces.extend(line[i:i + max_chars] for i in range(0, len(line), max_chars))
+
+    chunks = []
+    current = ""
+    for piece in pieces:
+        if current and len(current) + len(piece) > max_chars:
+            chunks.append(current)
+            current = ""
+        current += piece
+    if current.strip():
+        chunks.append(current)
+
+    return chunks or [extracted_text]
+
+
+def _generate_chunk_notes(extracted_text):
     try:
         response = openai_client.chat.completions.create(
-            model="gpt-4o-mini",
+            model=MODEL,
             messages=[
                 {
                     "role": "system",
-                    "content": (
-                        "As the perfect consistent educator, your task is to transform the provided text into well-structured, detailed lecture notes without leaving out any subject matter."
-                        "Omit all: course related information, administrative details, agendas, announcements, homework and other school related content."
-                        "Ensure that every single new and relevant information, definition, term, concept, and formula related to the course are included."
-                    )
+                    "content": NOTES_SYSTEM_PROMPT
                 },
                 {
                     "role": "user",
@@ -57,7 +169,146 @@ def generate_notes(extracted_text):
         return notes
     except Exception as e:
         print(f"Error: {e}")
-        return 'Error generating notes.'
+        return NOTES_ERROR
+
+
+def _generate_chunk_notes_with_retries(extracted_text):
+    notes = _generate_chunk_notes(extracted_text)
+    for attempt in range(NOTES_CHUNK_RETRIES):
+        if notes != NOTES_ERROR:
+            break
+        print(f"Retrying notes for a chunk (attempt {attempt + 2} of {NOTES_CHUNK_RETRIES + 1})")
+        notes = _generate_chunk_notes(extracted_text)
+    return notes
+
+
+def merge_notes(partial_notes):
+    """
+    Combine notes generated from consecutive chunks of the same document.
+
+    The parts are merged by the model when they are small enough for its output to hold
+    all of them, and concatenated in order otherwise. If any part failed the whole result is
+    an error, so notes with missing sections are never returned or cached as a success.
+
+    Args:
+        partial_notes (list): The notes for each chunk, in document order.
+
+    Returns:
+        str: The combined notes, or the notes error.
+    """
+    if not partial_notes or NOTES_ERROR in partial_notes:
+        return NOTES_ERROR
+
+    combined_notes = "\n\n".join(partial_notes)
+    if len(partial_notes) == 1 or estimate_tokens(combined_notes) > NOTES_MERGE_MAX_TOKENS:
+        return combined_notes
+
+    try:
+        response = openai_client.chat.completions.create(
+            model=MODEL,
+            messages=[
+                {"role": "system", "content": MERGE_NOTES_SYSTEM_PROMPT},
+                {"role": "user", "content": combined_notes}
+            ]
+        )
+        return response.choices[0].message.content
+    except Exception as e:
+        print(f"Error: {e}")
+        return combined_notes
+
+
+def generate_notes(extracted_text, use_cache=True):
+    """
+    Generate notes using OpenAI API.
+
+    This function generates notes from the provided text. Text longer than NOTES_CHUNK_TOKENS
+    is split on page and slide boundaries, notes are generated for up to NOTES_CONCURRENCY
+    chunks at a time, and the partial notes are merged.
+
+    Args:
+        extracted_text (str): The text extracted from the file.
+        use_cache (bool): Whether cached notes for the same text may be returned.
+
+    Returns:
+        str: Generated notes.
+    """
+    return cached_generation(MODEL, NOTES_SYSTEM_PROMPT, extracted_text, _generate_notes, use_cache)
+
+
+def _generate_notes(extracted_text):
+    chunks = chunk_extracted_text(extracted_text)
+    if len(chunks) == 1:
+        return _generate_chunk_notes_with_retries(chunks[0])
+
+    with ThreadPoolExecutor(max_workers=NOTES_CONCURRENCY, thread_name_prefix='notes') as executor:
+        partial_notes = list(executor.map(_generate_chunk_notes_with_retries, chunks))
+
+    return merge_notes(partial_notes)
+
+
+def _stream_chunk_notes(extracted_text):
+    response = openai_client.chat.completions.create(
+        model=MODEL,
+        messages=[
+            {"role": "system", "content": NOTES_SYSTEM_PROMPT},
+            {"role": "user", "content": extracted_text}
+        ],
+        stream=True
+    )
+    for chunk in response:
+        if chunk.choices and chunk.choices[0].delta.content:
+            yield chunk.choices[0].delta.content
+
+
+def stream_notes(extracted_text, use_cache=True):
+    """
+    Generate notes using the OpenAI streaming API, yielding text as it arrives.
+
+    Cached notes are yielded in one piece. For text that is split into several chunks, the
+    first chunk is streamed token by token while the others are generated in the background,
+    and each of those is yielded whole, in order, once it is ready. Those partial notes are
+    concatenated rather than merged, so the streamed text is the complete result.
+
+    Args:
+        extracted_text (str): The text extracted from the file.
+        use_cache (bool): Whether cached notes for the same text may be returned.
+
+    Yields:
+        str: Consecutive pieces of the generated notes.
+    """
+    key = _llm_cache_key(MODEL, NOTES_SYSTEM_PROMPT, extracted_text)
+    if LLM_CACHE_ENABLED and use_cache:
+        notes = llm_memory_cache.get(key)
+        if notes is None and llm_disk_cache is not None:
+            notes = llm_disk_cache.get(key)
+        if notes is not None:
+            yield notes
+            return
+
+    chunks = chunk_extracted_text(extracted_text)
+    if len(chunks) == 1:
+        parts = []
+        for delta in _stream_chunk_notes(chunks[0]):
+            parts.append(delta)
+            yield delta
+
+        # Only single-chunk notes match what generate_notes would return for the same text
+        notes = "".join(parts)
+        if LLM_CACHE_ENABLED and notes:
+            llm_memory_cache.set(key, notes)
+            if llm_disk_cache is not None:
+                llm_disk_cache.set(key, notes)
+        return
+
+    with ThreadPoolExecutor(max_workers=max(1, NOTES_CONCURRENCY - 1), thread_name_prefix='notes') as executor:
+        futures = [executor.submit(_generate_chunk_notes_with_retries, chunk) for chunk in chunks[1:]]
+        yield from _stream_chunk_notes(chunks[0])
+        for future in futures:
+            notes = future.result()
+            if notes == NOTES_ERROR:
+                # Fail the stream rather than end it with sections silently missing
+                raise RuntimeError(NOTES_ERROR)
+            yield "\n\n" + notes
 
 
 
@@ -120,34 +371,7 @@ def generate_flashcards(notes):
         return []
 
 
-def generate_mc_questions(notes):
-    """
-    Generate multiple-choice questions using OpenAI API.
-
-    This function generates multiple-choice questions from the provided text.
-    
-    Args:
-        notes (str): The summarized notes extracted from the lecture.
-
-    Returns:
-        list: Generated multiple-choice questions.
-    """
-
-
-        
-    class Question(BaseModel):
-
-        concept: str
-        question_type: str
-        question: str
-        possible_answers: List[str]
-        correct_answer: str
-        why: str
-
-    class List_of_questions(BaseModel):
-        generated_questions: List[Question]
-
-    initial_content = """
+MC_QUESTIONS_SYSTEM_PROMPT = """
             You are an AI model designed to generate high-quality multiple-choice questions based on the principles of synthesis, reorganization, context, comparison, and application. 
 
             For business, science, technology, engineering, and math notes, focus on equations and calculations if there are. For ALL formulas or expressions, you must **strictly format them in LaTeX** and enclose the entire formula in `$...$` for inline expressions or `$$...$$` for block-level expressions. Strictly format such questions, possible answers, and explanations in LaTeX. You should make sure that the answers are not always the same, and that the correct answer is NOT always the first option, rather it should be a random option each time, and the correct answer should be different each time.
@@ -193,11 +417,40 @@ def generate_mc_questions(notes):
     """
 
 
+def generate_mc_questions(notes, use_cache=True):
+    """
+    Generate multiple-choice questions using OpenAI API.
+
+    This function generates multiple-choice questions from the provided text.
+    
+    Args:
+        notes (str): The summarized notes extracted from the lecture.
+        use_cache (bool): Whether a cached result for the same notes may be returned.
+
+    Returns:
+        list: Generated multiple-choice questions.
+    """
+    return cached_generation(MODEL, MC_QUESTIONS_SYSTEM_PROMPT, notes, _generate_mc_questions, use_cache)
+
+
+def _generate_mc_questions(notes):
+    class Question(BaseModel):
+
+        concept: str
+        question_type: str
+        question: str
+        possible_answers: List[str]
+        correct_answer: str
+        why: str
+
+    class List_of_questions(BaseModel):
+        generated_questions: List[Question]
+
     try:
         response = openai_client.beta.chat.completions.parse(
-            model="gpt-4o-mini",
+            model=MODEL,
             messages=[
-                {"role": "system", "content": initial_content},
+                {"role": "system", "content": MC_QUESTIONS_SYSTEM_PROMPT},
                 {"role": "user", "content": notes}
             ],
             response_format=List_of_questions,  
@@ -216,7 +469,25 @@ def generate_mc_questions(notes):
 
 
 
-def generate_flashcards(notes):
+FLASHCARDS_SYSTEM_PROMPT = '''
+                        You are an AI model designed to transform the provided notes into high-quality flashcards that cover all key concepts, topics, and terms.
+                        Ensure that each question can be answered using **only** the information contained within the provided text.
+                        Avoid generating questions that require any outside knowledge or inference.
+                        Keep questions and answers clear, concise, and directly related to the provided material.
+                                
+                        Create one flashcard for each key idea, focusing on definitions, explanations, and concepts mentioned in the text.
+                        Always aim to maximize the number of flashcards in proportion to the depth and detail of the material.
+                        Prioritize completeness and ensure that the flashcards reflect the full scope of the content without introducing extraneous information.
+            
+                        Each flashcard must strictly follow the EXACT text format below:
+                                                    
+                        Flashcard 1:
+                        Front: What is Dollar-Cost Averaging (DCA)?
+                        Back: Investing a fixed amount on a regular schedule
+                    '''
+
+
+def generate_flashcards(notes, use_cache=True):
     """
     Generate flashcards using OpenAI API.
 
@@ -224,32 +495,22 @@ def generate_flashcards(notes):
     
     Args:
         notes (str): The summarized notes extracted from the lecture.
+        use_cache (bool): Whether a cached result for the same notes may be returned.
 
     Returns:
         list: Generated flashcards.
     """
+    return cached_generation(MODEL, FLASHCARDS_SYSTEM_PROMPT, notes, _generate_flashcards, use_cache)
+
+
+def _generate_flashcards(notes):
     try:
         response = openai_client.chat.completions.create(
-            model="gpt-4o-mini",
+            model=MODEL,
             messages=[
                 {
                     "role": "system",
-                    "content": ('''
-                        You are an AI model designed to transform the provided notes into high-quality flashcards that cover all key concepts, topics, and terms.
-                        Ensure that each question can be answered using **only** the information contained within the provided text.
-                        Avoid generating questions that require any outside knowledge or inference.
-                        Keep questions and answers clear, concise, and directly related to the provided material.
-                                
-                        Create one flashcard for each key idea, focusing on definitions, explanations, and concepts mentioned in the text.
-                        Always aim to maximize the number of flashcards in proportion to the depth and detail of the material.
-                        Prioritize completeness and ensure that the flashcards reflect the full scope of the content without introducing extraneous information.
-            
-                        Each flashcard must strictly follow the EXACT text format below:
-                                                    
-                        Flashcard 1:
-                        Front: What is Dollar-Cost Averaging (DCA)?
-                        Back: Investing a fixed amount on a regular schedule
-                    ''')
+                    "content": FLASHCARDS_SYSTEM_PROMPT
                 },
                 {
                     "role": "user",
@@ -278,61 +539,49 @@ def generate_flashcards(notes):
     return flashcards
 
 
-def calculate_dynamic_intervals(due_by):
+def submit_study_materials(notes, use_cache=True):
     """
-    Calculate dynamic intervals based on the due date.
+    Start generating multiple-choice questions and flashcards from the same notes at once.
 
     Args:
-        due_by (datetime): The due date for the course.
+        notes (str): The summarized notes extracted from the lecture.
+        use_cache (bool): Whether cached results for the same notes may be returned.
 
     Returns:
-        list: A list of intervals in days.
+        dict: Futures for 'mc_questions' and 'flashcards'.
     """
-    today = datetime.now()
-    total_days = (due_by - today).days
-
-    # Generate intervals based on the total days until due
-    if total_days <= 0:
-        return [1]  # If due date is today or past, return immediate review
-
-    # Logarithmic distribution of intervals
-    intervals = []
-    for i in range(7):  # Generate 7 intervals
-        interval = int(total_days * (1 - (0.5 ** i)))  # Logarithmic spacing
-        intervals.append(max(1, interval))  # Ensure at least 1 day
+    executor = _generation_executor.get()
+    return {
+        'mc_questions': executor.submit(generate_mc_questions, notes, use_cache),
+        'flashcards': executor.submit(generate_flashcards, notes, use_cache),
+    }
 
-    return intervals
 
-def calculate_next_study_date(clerk_id, course_name, card_id):
+def generate_study_materials(notes, timeout=GENERATION_TIMEOUT_SECONDS, use_cache=True):
     """
-    Calculate the next study date for a flashcard based on how many times it has been seen.
+    Generate multiple-choice questions and flashcards concurrently.
+
+    Both calls start together, so the wall-clock time is roughly that of the slower one.
+    A call that has not finished within `timeout` seconds of starting yields an empty list.
 
     Args:
-        clerk_id (str): The Clerk ID of the user.
-        course_name (str): The name of the course.
-        card_id (str): The ID of the flashcard.
+        notes (str): The summarized notes extracted from the lecture.
+        timeout (float): Seconds each call is allowed to take.
+        use_cache (bool): Whether cached results for the same notes may be returned.
 
     Returns:
-        None
+        tuple: The generated multiple-choice questions and flashcards.
     """
-    times_seen = get_times_seen(clerk_id, course_name, card_id)
-    
-    # Retrieve the course to get the due_by date
-    course = courses_collection.find_one({"clerk_id": clerk_id, "courses.course_name": course_name})
-    due_by = course['due_by'] if course else None
-
-    if not due_by:
-        return  # Handle case where course is not found
-
-    # Calculate dynamic intervals based on the due_by date
-    intervals = calculate_dynamic_intervals(due_by)
-
-    if times_seen < len(intervals):
-        next_interval = intervals[times_seen]
-    else:
-        next_interval = intervals[-1]  # Use the last interval for more than 7 views
-
-    next_study_date = datetime.now() + datetime.timedelta(days=next_interval)
-
-    # Update the next study date in MongoDB
-    create_or_update_next_study_date(clerk_id, course_name, card_id, next_study_date)
\ No newline at end of file
+    futures = submit_study_materials(notes, use_cache)
+    deadline = time.monotonic() + timeout
+
+    results = {}
+    for name, future in futures.items():
+        try:
+            results[name] = future.result(timeout=max(0, deadline - time.monotonic()))
+        except FuturesTimeoutError:
+            print(f"Error: {name} generation timed out after {timeout} seconds")
+            future.cancel()
+            results[name] = []
+
+    return results['mc_questions'], results['flashcards']
@@ -0,0 +1,154 @@
+import json
+import os
+import threading
+import time
+from collections import OrderedDict
+
+import lmdb
+
+
+class LRUCache:
+    """
+    A thread-safe in-process LRU cache with an optional TTL and memory cap.
+
+    Args:
+        maxsize (int): The maximum number of entries kept before the least recently used one is evicted.
+        ttl (float, optional): Seconds an entry stays valid. Entries never expire when None.
+        max_bytes (int, optional): The maximum total size of the cached values. Unbounded when None.
+        sizeof (callable, optional): Returns the size in bytes of a value. Required with max_bytes.
+    """
+
+    def __init__(self, maxsize=1024, ttl=None, max_bytes=None, sizeof=None):
+        self.maxsize = maxsize
+        self.ttl = ttl
+        self.max_bytes = max_bytes
+        self.sizeof = sizeof
+        self.hits = 0
+        self.misses = 0
+        self._bytes = 0
+        self._data = OrderedDict()
+        self._lock = threading.Lock()
+
+    def get(self, key):
+        """
+        Return the cached value for key, or None on a miss.
+        """
+        with self._lock:
+            entry = self._data.get(key)
+            if entry is not None:
+                expires_at, value, _ = entry
+                if expires_at is None or expires_at > time.time():
+                    self._data.move_to_end(key)
+                    self.hits += 1
+                    return value
+                self._pop(key)
+            self.misses += 1
+            return None
+
+    def set(self, key, value):
+        expires_at = time.time() + self.ttl if self.ttl else None
+        size = self.sizeof(value) if self.max_bytes is not None else 0
+        with self._lock:
+            self._pop(key)
+            if self.max_bytes is not None and size > self.max_bytes:
+                # Larger than the whole cache: not worth evicting everything else for
+                return
+            self._data[key] = (expires_at, value, size)
+            self._bytes += size
+            while len(self._data) > self.maxsize or (self.max_bytes is not None and self._bytes > self.max_bytes):
+                _, (_, _, evicted_size) = self._data.popitem(last=False)
+                self._bytes -= evicted_size
+
+    def _pop(self, key):
+        # Callers hold the lock
+        entry = self._data.pop(key, None)
+        if entry is not None:
+            self._bytes -= entry[2]
+
+    def delete(self, key):
+        with self._lock:
+            self._pop(key)
+
+    def clear(self):
+        with self._lock:
+            self._data.clear()
+            self._bytes = 0
+
+    def __len__(self):
+        return len(self._data)
+
+    def stats(self):
+        return {'size': len(self._data), 'maxsize': self.maxsize, 'bytes': self._bytes, 'max_bytes': self.max_bytes,
+                'hits': self.hits, 'misses': self.misses}
+
+
+class LMDBCache:
+    """
+    A persistent key/value cache stored in an LMDB environment on local disk.
+
+    Values are stored as JSON. The environment is opened lazily in each process, since
+    LMDB handles must not be shared across a fork. Any LMDB error disables the tier
+    for that lookup instead of failing the caller.
+
+    Args:
+        path (str): The directory of the LMDB environment.
+        map_size (int): The maximum size of the database in bytes.
+        ttl (float, optional): Seconds an entry stays valid. Entries never expire when None.
+    """
+
+    def __init__(self, path, map_size=1 << 30, ttl=None):
+        self.path = path
+        self.map_size = map_size
+        self.ttl = ttl
+        self.hits = 0
+        self.misses = 0
+        self._env = None
+        self._env_pid = None
+        self._lock = threading.Lock()
+
+    def _get_env(self):
+        with self._lock:
+            if self._env is None or self._env_pid != os.getpid():
+                os.makedirs(self.path, exist_ok=True)
+                self._env = lmdb.open(self.path, map_size=self.map_size, max_readers=256)
+                self._env_pid = os.getpid()
+            return self._env
+
+    def get(self, key):
+        """
+        Return the cached value for key, or None on a miss.
+        """
+        try:
+            with self._get_env().begin() as txn:
+                raw = txn.get(key.encode('utf-8'))
+        except lmdb.Error as e:
+            print(f"Error reading cache {self.path}: {e}")
+            return None
+
+        if raw is not None:
+            entry = json.loads(raw)
+            if entry['expires_at'] is None or entry['expires_at'] > time.time():
+                self.hits += 1
+                return entry['value']
+            self.delete(key)
+        self.misses += 1
+        return None
+
+    def set(self, key, value):
+        expires_at = time.time() + self.ttl if self.ttl else None
+        raw = json.dumps({'expires_at': expires_at, 'value': value}).encode('utf-8')
+        try:
+            with self._get_env().begin(write=True) as txn:
+                txn.put(key.encode('utf-8'), raw)
+        except lmdb.Error as e:
+            print(f"Error writing cache {self.path}: {e}")
+
+    def delete(self, key):
+        try:
+            with self._get_env().begin(write=True) as txn:
+                txn.delete(key.encode('utf-8'))
+        except lmdb.Error as e:
+            print(f"Error deleting from cache {self.path}: {e}")
+
+    def stats(self):
+        return {'path': self.path, 'hits': self.hits, 'misses': self.misses}
@@ -0,0 +1,136 @@
+from pymongo import ASCENDING
+from .db import collection
+import os
+import datetime
+import time
+
+# Change log setup. Every write to a user's courses bumps the `rev` counter on their courses
+# document and logs one entry at that rev naming what it touched:
+# {clerk_id, rev, at, changes: [{course} | {course, concept} | {course, card}] or None}.
+# A None change list means anything may have changed. Clients sync from these entries.
+SYNC_CHANGES_TTL_SECONDS = int(os.getenv('SYNC_CHANGES_TTL_SECONDS', str(30 * 24 * 3600)))
+# A rev without a log entry is assumed to be a write still in flight until a later entry is
+# this old; after that the entry is taken as lost and affected clients are sent a full reset
+SYNC_GAP_GRACE_SECONDS = int(os.getenv('SYNC_GAP_GRACE_SECONDS', '60'))
+
+changes_collection = collection('changes')
+
+CHANGE_INDEXES = [
+    ([("clerk_id", ASCENDING), ("rev", ASCENDING)], {"name": "clerk_id_rev", "unique": True}),
+    ([("at", ASCENDING)], {"name": "at_ttl", "expireAfterSeconds": SYNC_CHANGES_TTL_SECONDS}),
+]
+
+
+def log_changes(clerk_id, rev, changes):
+    """
+    Log what a write at the given revision touched.
+
+    Args:
+        clerk_id (str): The Clerk ID of the user.
+        rev (int): The revision of the user's courses after the write.
+        changes (list or None): The changed entities, or None if anything may have changed.
+
+    Returns:
+        None
+    """
+    changes_collection.insert_one({
+        "clerk_id": clerk_id,
+        "rev": rev,
+        "at": datetime.datetime.now(datetime.timezone.utc),
+        "changes": changes,
+    })
+
+
+def read_changes(clerk_id, since, until, until_at):
+    """
+    Read the change log between two revisions, stopping at the first missing entry.
+
+    Args:
+        clerk_id (str): The Clerk ID of the user.
+        since (int): The oldest revision a client has; entries after it are read.
+        until (int): The current revision.
+        until_at (datetime or None): When the current revision was written.
+
+    Returns:
+        tuple: The revision the entries cover up to, the entries, and whether an entry was
+            lost, in which case clients at `since` need a full reset.
+    """
+    entries = list(changes_collection.find(
+        {"clerk_id": clerk_id, "rev": {"$gt": since, "$lte": until}},
+        {"_id": 0, "rev": 1, "at": 1, "changes": 1}
+    ).sort("rev", ASCENDING))
+
+    expected = since + 1
+    for index, entry in enumerate(entries):
+        if entry['rev'] != expected:
+            break
+        expected += 1
+    else:
+        index = len(entries)
+    if expected > until:
+        return until, entries, False
+
+    # Entry `expected` is missing, or expired; it is lost if a write after it is past the grace period
+    written_after = [entry['at'] for entry in entries[index:]] + [until_at]
+    if any(at is None or _timestamp(at) < time.time() - SYNC_GAP_GRACE_SECONDS for at in written_after):
+        return until, entries, True
+    return expected - 1, entries[:index], False
+
+
+def _timestamp(at):
+    if at.tzinfo is None:
+        at = at.replace(tzinfo=datetime.timezone.utc)
+    return at.timestamp()
+
+
+def course_delta(course_name, course, entries):
+    """
+    Describe how a course changed over the given change log entries.
+
+    Entities named by the entries are looked up in the current course, so the delta carries
+    their latest content and anything no longer found is reported as deleted.
+
+    Args:
+        course_name (str): The name of the course.
+        course (dict or None): The current course, as returned by get_courses, or None if it is gone.
+        entries (list): The change log entries.
+
+    Returns:
+        dict: {"deleted": True}, {"course": ...} when the whole course must be resent, or the
+            changed and deleted concepts and cards (empty when nothing changed).
+    """
+    if course is None:
+        return {"deleted": True}
+
+    concept_names = []
+    card_ids = []
+    for entry in entries:
+        if entry['changes'] is None:
+            return {"course": course}
+        for change in entry['changes']:
+            if change.get('course') != course_name:
+                continue
+            if 'concept' in change:
+                concept_names.append(change['concept'])
+            elif 'card' in change:
+                card_ids.append(change['card'])
+            else:
+                return {"course": course}
+
+    concepts = {concept['concept_name']: concept for concept in course.get('concepts') or []}
+    cards = {card.get('id'): (None, card) for card in course.get('flashcards') or []}
+    for concept in concepts.values():
+        cards.update({card.get('id'): (concept['concept_name'], card) for card in concept.get('concept_flashcards') or []})
+
+    changed_concepts = list(dict.fromkeys(concept_names))
+    changed_cards = [
+        card_id for card_id in dict.fromkeys(card_ids)
+        if card_id not in cards or cards[card_id][0] not in changed_concepts
+    ]
+    delta = {
+        "concepts": [concepts[name] for name in changed_concepts if name in concepts],
+        "deleted_concepts": [name for name in changed_concepts if name not in concepts],
+        "cards": [{"concept": cards[card_id][0], "card": cards[card_id][1]} for card_id in changed_cards if card_id in cards],
+        "deleted_cards": [card_id for card_id in changed_cards if card_id not in cards],
+    }
+    return {key: value for key, value in delta.items() if value}
@@ -0,0 +1,179 @@
+import os
+import threading
+
+from dotenv import load_dotenv
+from pymongo import MongoClient, monitoring
+
+load_dotenv()
+
+# MongoDB setup. The client is created lazily in each process, after gunicorn has forked,
+# and every helper shares it.
+MONGO_URI = os.getenv('MONGO_URI')
+MONGO_DB_NAME = os.getenv('MONGO_DB_NAME', 'VeidaAI')
+MONGO_MAX_POOL_SIZE = int(os.getenv('MONGO_MAX_POOL_SIZE', '50'))
+MONGO_MIN_POOL_SIZE = int(os.getenv('MONGO_MIN_POOL_SIZE', '0'))
+MONGO_MAX_IDLE_TIME_MS = int(os.getenv('MONGO_MAX_IDLE_TIME_MS', '300000'))
+MONGO_CONNECT_TIMEOUT_MS = int(os.getenv('MONGO_CONNECT_TIMEOUT_MS', '10000'))
+MONGO_SERVER_SELECTION_TIMEOUT_MS = int(os.getenv('MONGO_SERVER_SELECTION_TIMEOUT_MS', '10000'))
+MONGO_SOCKET_TIMEOUT_MS = int(os.getenv('MONGO_SOCKET_TIMEOUT_MS', '0')) or None
+MONGO_WAIT_QUEUE_TIMEOUT_MS = int(os.getenv('MONGO_WAIT_QUEUE_TIMEOUT_MS', '0')) or None
+MONGO_READ_PREFERENCE = os.getenv('MONGO_READ_PREFERENCE', 'primary')
+
+_client = None
+_client_pid = None
+_client_lock = threading.Lock()
+
+
+class PoolStats(monitoring.ConnectionPoolListener):
+    """
+    Counts connection pool events for the process's client.
+    """
+
+    def __init__(self):
+        self._lock = threading.Lock()
+        self.counters = {
+            'connections_created': 0,
+            'connections_closed': 0,
+            'checked_out': 0,
+            'checkouts': 0,
+            'checkout_failures': 0,
+            'pool_clears': 0,
+        }
+
+    def _add(self, counter, amount=1):
+        with self._lock:
+            self.counters[counter] += amount
+
+    def pool_created(self, event):
+        pass
+
+    def pool_ready(self, event):
+        pass
+
+    def pool_cleared(self, event):
+        self._add('pool_clears')
+
+    def pool_closed(self, event):
+        pass
+
+    def connection_created(self, event):
+        self._add('connections_created')
+
+    def connection_ready(self, event):
+        pass
+
+    def connection_closed(self, event):
+        self._add('connections_closed')
+
+    def connection_check_out_started(self, event):
+        pass
+
+    def connection_check_out_failed(self, event):
+        self._add('checkout_failures')
+
+    def connection_checked_out(self, event):
+        self._add('checkouts')
+        self._add('checked_out')
+
+    def connection_checked_in(self, event):
+        self._add('checked_out', -1)
+
+    def snapshot(self):
+        with self._lock:
+            return dict(self.counters)
+
+
+_pool_stats = PoolStats()
+
+
+def get_client():
+    """
+    Return this process's MongoClient, creating it on first use.
+
+    A client inherited across a fork is never reused; the child builds its own.
+    """
+    global _client, _client_pid, _pool_stats
+    if _client is not None and _client_pid == os.getpid():
+        return _client
+
+    with _client_lock:
+        if _client is None or _client_pid != os.getpid():
+            _pool_stats = PoolStats()
+            _client = MongoClient(
+                MONGO_URI,
+                maxPoolSize=MONGO_MAX_POOL_SIZE,
+                minPoolSize=MONGO_MIN_POOL_SIZE,
+                maxIdleTimeMS=MONGO_MAX_IDLE_TIME_MS,
+                connectTimeoutMS=MONGO_CONNECT_TIMEOUT_MS,
+                serverSelectionTimeoutMS=MONGO_SERVER_SELECTION_TIMEOUT_MS,
+                socketTimeoutMS=MONGO_SOCKET_TIMEOUT_MS,
+                waitQueueTimeoutMS=MONGO_WAIT_QUEUE_TIMEOUT_MS,
+                readPreference=MONGO_READ_PREFERENCE,
+                event_listeners=[_pool_stats],
+            )
+            _client_pid = os.getpid()
+    return _client
+
+
+def get_db():
+    return get_client()[MONGO_DB_NAME]
+
+
+def close_client():
+    """
+    Close this process's client, e.g. from a gunicorn worker_exit hook.
+    """
+    global _client, _client_pid
+    with _client_lock:
+        if _client is not None and _client_pid == os.getpid():
+            _client.close()
+        _client = None
+        _client_pid = None
+
+
+def pool_stats():
+    """
+    Return the connection pool configuration and event counters for this process.
+    """
+    return {
+        'pid': os.getpid(),
+        'connected': _client is not None and _client_pid == os.getpid(),
+        'max_pool_size': MONGO_MAX_POOL_SIZE,
+        'min_pool_size': MONGO_MIN_POOL_SIZE,
+        'read_preference': MONGO_READ_PREFERENCE,
+        **_pool_stats.snapshot(),
+    }
+
+
+class _LazyDatabase:
+    # Resolves attribute and item access against the current process's database
+    def __getattr__(self, name):
+        return getattr(get_db(), name)
+
+    def __getitem__(self, name):
+        return get_db()[name]
+
+
+class _LazyCollection:
+    # Resolves attribute access against the named collection of the current process's database
+    def __init__(self, name):
+        self._name = name
+
+    def __getattr__(self, attr):
+        return getattr(get_db()[self._name], attr)
+
+
+db = _LazyDatabase()
+
+
+def collection(name):
+    """
+    Return a module-level handle to a collection that is safe to create at import time.
+
+    Args:
+        name (str): The name of the collection.
+
+    Returns:
+        A proxy that forwards every call to the collection of the process's shared client.
+    """
+    return _LazyCollection(name)
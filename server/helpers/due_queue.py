@@ -0,0 +1,249 @@
+from .db import collection
+from . import flashcards as flashcard_store
+import os
+import datetime
+import threading
+import time
+
+# Due queue setup. Each user has one document listing the cards due on its date:
+# {clerk_id, date, cards: [{course, concept, card}]}. It is rebuilt when first read on a new
+# day and kept current by the write helpers in helpers/mongo.py.
+DUE_QUEUE_ROLLOVER_ENABLED = os.getenv('DUE_QUEUE_ROLLOVER_ENABLED', 'true').lower() == 'true'
+# Seconds after midnight at which the daily rollover starts
+DUE_QUEUE_ROLLOVER_OFFSET_SECONDS = int(os.getenv('DUE_QUEUE_ROLLOVER_OFFSET_SECONDS', '60'))
+
+courses_collection = collection('courses')
+due_queues_collection = collection('due_queues')
+
+_rollover_thread = None
+_rollover_pid = None
+_rollover_lock = threading.Lock()
+
+
+def _today():
+    return datetime.datetime.now().date().strftime("%Y-%m-%d")
+
+
+def _is_due(card, today):
+    review_dates = card.get('review_dates') or []
+    if flashcard_store.use_flashcard_collection():
+        # The flashcards collection keeps overdue cards due until they are reviewed
+        return bool(review_dates) and min(review_dates) <= today
+    return today in review_dates
+
+
+def _scan_due_cards(clerk_id, today):
+    """
+    Find every card due on the given day from the flashcard storage.
+
+    Args:
+        clerk_id (str): The Clerk ID of the user.
+        today (str): The day, as 'YYYY-MM-DD'.
+
+    Returns:
+        list: Queue entries with the course, concept and card.
+    """
+    if flashcard_store.use_flashcard_collection():
+        cards = flashcard_store.flashcards_collection.find(
+            {"clerk_id": clerk_id, "next_due": {"$lte": today}},
+            {"_id": 0, "clerk_id": 0, "next_due": 0}
+        )
+        return [{"course": card.pop('course'), "concept": card.pop('concept'), "card": card} for card in cards]
+
+    user = courses_collection.find_one({"clerk_id": clerk_id}, {"_id": 0, "courses.course_name": 1, "courses.concepts": 1})
+    entries = []
+    for course in (user or {}).get('courses', []):
+        for concept in course.get('concepts', []):
+            for card in concept.get('concept_flashcards', []):
+                if today in card.get('review_dates', []):
+                    entries.append({"course": course['course_name'], "concept": concept['concept_name'], "card": card})
+    return entries
+
+
+def rebuild_due_queue(clerk_id, today=None):
+    """
+    Recompute a user's due queue from the flashcard storage.
+
+    Args:
+        clerk_id (str): The Clerk ID of the user.
+        today (str, optional): The day to build the queue for. Defaults to today.
+
+    Returns:
+        dict: The new queue document.
+    """
+    today = today or _today()
+    queue = {"clerk_id": clerk_id, "date": today, "cards": _scan_due_cards(clerk_id, today)}
+    due_queues_collection.replace_one({"clerk_id": clerk_id}, queue, upsert=True)
+    return queue
+
+
+def get_due_cards(clerk_id, course_name=None):
+    """
+    Retrieve today's due cards from the user's queue, rebuilding it if it is from another day.
+
+    Args:
+        clerk_id (str): The Clerk ID of the user.
+        course_name (str, optional): Only return cards from this course.
+
+    Returns:
+        list: The due flashcards.
+    """
+    today = _today()
+    queue = due_queues_collection.find_one({"clerk_id": clerk_id}, {"_id": 0})
+    if queue is None or queue.get('date') != today:
+        queue = rebuild_due_queue(clerk_id, today)
+
+    return [entry['card'] for entry in queue['cards'] if course_name is None or entry['course'] == course_name]
+
+
+def queue_cards(clerk_id, course_name, concept_name, cards):
+    """
+    Add the given cards that are due today to the user's queue.
+
+    Only a queue built today is updated; an older one is rebuilt on its next read anyway.
+
+    Args:
+        clerk_id (str): The Clerk ID of the user.
+        course_name (str): The name of the course.
+        concept_name (str): The name of the concept.
+        cards (list): Newly stored flashcards.
+
+    Returns:
+        None
+    """
+    today = _today()
+    entries = [{"course": course_name, "concept": concept_name, "card": card} for card in cards if _is_due(card, today)]
+    if entries:
+        due_queues_collection.update_one(
+            {"clerk_id": clerk_id, "date": today},
+            {"$push": {"cards": {"$each": entries}}}
+        )
+
+
+def dequeue_cards(clerk_id, course_name=None, concept_name=None, card_id=None, card_ids=None):
+    """
+    Remove cards from the user's queue once they are reviewed or deleted.
+
+    Args:
+        clerk_id (str): The Clerk ID of the user.
+        course_name (str, optional): Remove the cards of this course.
+        concept_name (str, optional): Remove the cards of this concept.
+        card_id (str, optional): Remove this card.
+        card_ids (list, optional): Remove these cards.
+
+    Returns:
+        None
+    """
+    match = {}
+    if course_name is not None:
+        match["course"] = course_name
+    if concept_name is not None:
+        match["concept"] = concept_name
+    if card_id is not None:
+        match["card.id"] = card_id
+    if card_ids is not None:
+        match["card.id"] = {"$in": card_ids}
+    if match:
+        due_queues_collection.update_one({"clerk_id": clerk_id}, {"$pull": {"cards": match}})
+
+
+def rename_queued_cards(clerk_id, course_name, new_course_name, concept_name=None, new_concept_name=None):
+    """
+    Re-point queued cards at a renamed course or concept.
+
+    Args:
+        clerk_id (str): The Clerk ID of the user.
+        course_name (str): The current name of the course.
+        new_course_name (str): The new name of the course.
+        concept_name (str, optional): Only rename entries of this concept.
+        new_concept_name (str, optional): The new name of the concept.
+
+    Returns:
+        None
+    """
+    entry_filter = {"entry.course": course_name}
+    update = {"cards.$[entry].course": new_course_name}
+    if concept_name is not None:
+        entry_filter["entry.concept"] = concept_name
+        update["cards.$[entry].concept"] = new_concept_name or concept_name
+    due_queues_collection.update_one({"clerk_id": clerk_id}, {"$set": update}, array_filters=[entry_filter])
+
+
+def update_queued_card(clerk_id, card_id, update):
+    """
+    Apply a flashcard update to the copy of the card in the user's queue.
+
+    Args:
+        clerk_id (str): The Clerk ID of the user.
+        card_id (str): The ID of the flashcard.
+        update (dict): An update document on card fields, e.g. {"$inc": {"times_seen": 1}}.
+
+    Returns:
+        None
+    """
+    queue_update = {
+        operator: {f"cards.$[entry].card.{field}": value for field, value in fields.items()}
+        for operator, fields in update.items() if fields
+    }
+    if queue_update:
+        due_queues_collection.update_one(
+            {"clerk_id": clerk_id, "cards.card.id": card_id},
+            queue_update,
+            array_filters=[{"entry.card.id": card_id}]
+        )
+
+
+def invalidate_due_queue(clerk_id):
+    # Drop the queue so the next read rebuilds it, for changes that are not worth patching in
+    due_queues_collection.delete_one({"clerk_id": clerk_id})
+
+
+def roll_over_due_queues(today=None):
+    """
+    Rebuild every queue that is not from today, so users find a ready queue on their first visit.
+
+    Args:
+        today (str, optional): The day to build the queues for. Defaults to today.
+
+    Returns:
+        int: The number of queues rebuilt.
+    """
+    today = today or _today()
+    rebuilt = 0
+    for queue in due_queues_collection.find({"date": {"$ne": today}}, {"_id": 0, "clerk_id": 1}):
+        try:
+            rebuild_due_queue(queue['clerk_id'], today)
+            rebuilt += 1
+        except Exception as e:
+            print(f"Error rolling over due queue for clerk_id {queue['clerk_id']}: {e}")
+    return rebuilt
+
+
+def _seconds_until_rollover():
+    now = datetime.datetime.now()
+    tomorrow = datetime.datetime.combine(now.date() + datetime.timedelta(days=1), datetime.time())
+    return (tomorrow - now).total_seconds() + DUE_QUEUE_ROLLOVER_OFFSET_SECONDS
+
+
+def _rollover_loop():
+    while True:
+        time.sleep(_seconds_until_rollover())
+        try:
+            rebuilt = roll_over_due_queues()
+            print(f"Rolled over {rebuilt} due queues")
+        except Exception as e:
+            print(f"Error rolling over due queues: {e}")
+
+
+def start_due_queue_rollover():
+    """
+    Start the daily rollover thread for this process, once.
+    """
+    global _rollover_thread, _rollover_pid
+    if not DUE_QUEUE_ROLLOVER_ENABLED:
+        return
+    with _rollover_lock:
+        if _rollover_thread is None or _rollover_pid != os.getpid():
+            _rollover_thread = threading.Thread(target=_rollover_loop, name='due-queue-rollover', daemon=True)
+            _rollover_thread.start()
+            _rollover_pid = os.getpid()
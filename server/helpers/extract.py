@@ -0,0 +1,279 @@
+import hashlib
+import math
+import multiprocessing
+import os
+import tempfile
+import threading
+from concurrent.futures import ProcessPoolExecutor
+
+import cv2
+import fitz  # PyMuPDF
+import numpy as np
+import pytesseract
+from paddleocr import PaddleOCR
+from pptx import Presentation
+from .cache import LRUCache, LMDBCache
+from .util import PAGE_BREAK
+
+pytesseract.pytesseract.tesseract_cmd = os.getenv('TESSERACT_CMD', 'tesseract')
+
+# Parallel PDF extraction setup. PDF_WORKERS=1 keeps extraction in the request
+# thread, PDF_WORKERS=0 uses every core on the box.
+PDF_WORKERS = int(os.getenv('PDF_WORKERS', '1')) or (os.cpu_count() or 1)
+PDF_PARALLEL_MIN_PAGES = int(os.getenv('PDF_PARALLEL_MIN_PAGES', '16'))
+
+# OCR result cache setup. Results are keyed by a hash of the raw image bytes and kept in an
+# in-process LRU in front of an LMDB store on disk; an empty OCR_CACHE_PATH disables the disk tier.
+OCR_CACHE_SIZE = int(os.getenv('OCR_CACHE_SIZE', '4096'))
+OCR_CACHE_PATH = os.getenv('OCR_CACHE_PATH', '.cache/ocr')
+OCR_CACHE_MAP_SIZE = int(os.getenv('OCR_CACHE_MAP_SIZE', str(1 << 30)))
+# Bump when the preprocessing in process_image changes so older results are not reused
+OCR_CACHE_VERSION = 'v1'
+
+ocr_memory_cache = LRUCache(maxsize=OCR_CACHE_SIZE)
+ocr_disk_cache = LMDBCache(OCR_CACHE_PATH, map_size=OCR_CACHE_MAP_SIZE) if OCR_CACHE_PATH else None
+
+_ocr = None
+_ocr_pid = None
+# PaddleOCR is not thread-safe; the lock covers both creating the instance and running it
+_ocr_lock = threading.RLock()
+_pdf_pool = None
+_pdf_pool_pid = None
+_pdf_pool_lock = threading.Lock()
+
+
+def get_ocr():
+    """
+    Return this process's PaddleOCR instance, creating it on first use.
+
+    Run it through run_ocr, which serializes the calls of request and job threads.
+    """
+    global _ocr, _ocr_pid
+    with _ocr_lock:
+        if _ocr is None or _ocr_pid != os.getpid():
+            _ocr = PaddleOCR(use_angle_cls=True, lang='en')
+            _ocr_pid = os.getpid()
+        return _ocr
+
+
+def run_ocr(image):
+    """
+    Run this process's PaddleOCR instance on an image, one call at a time.
+
+    Args:
+        image (ndarray): The preprocessed image.
+
+    Returns:
+        list: The PaddleOCR result.
+    """
+    with _ocr_lock:
+        return get_ocr().ocr(image, cls=True)
+
+
+def _get_pdf_pool():
+    global _pdf_pool, _pdf_pool_pid
+    with _pdf_pool_lock:
+        if _pdf_pool is None or _pdf_pool_pid != os.getpid():
+            # Spawn rather than fork: the parent already has Paddle and request threads loaded
+            _pdf_pool = ProcessPoolExecutor(
+                max_workers=PDF_WORKERS,
+                mp_context=multiprocessing.get_context('spawn'),
+                initializer=get_ocr
+            )
+            _pdf_pool_pid = os.getpid()
+        return _pdf_pool
+
+
+def _page_ranges(page_count, workers):
+    # Two ranges per worker so one slow, image-heavy range doesn't leave the others idle
+    range_size = max(1, math.ceil(page_count / (workers * 2)))
+    return [(start, min(start + range_size, page_count)) for start in range(0, page_count, range_size)]
+
+
+def _index_pdf_images(pdf_document):
+    """
+    List the image xrefs referenced by each page, and the first page that references each xref.
+    """
+    page_xrefs = []
+    first_pages = {}
+    for page_number, page in enumerate(pdf_document):
+        xrefs = [img[0] for img in page.get_images(full=True)]
+        page_xrefs.append(xrefs)
+        for xref in xrefs:
+            first_pages.setdefault(xref, page_number)
+    return page_xrefs, first_pages
+
+
+def _extract_pdf_range(pdf_document, start, end, xrefs):
+    # Extract text directly from the PDF's text layer
+    page_texts = [pdf_document[page_number].get_text() for page_number in range(start, end)]
+
+    # Extract each unique image once and apply OCR, without resizing
+    image_texts = {}
+    for xref in xrefs:
+        base_image = pdf_document.extract_image(xref)
+        image_texts[xref] = ocr_image_bytes(base_image["image"])
+
+    return page_texts, image_texts
+
+
+def _extract_pdf_range_from_file(pdf_path, start, end, xrefs):
+    with fitz.open(pdf_path) as pdf_document:
+        return _extract_pdf_range(pdf_document, start, end, xrefs)
+
+
+def _assemble_pdf_text(page_texts, page_xrefs, image_texts):
+    # Shared images are OCR'd once but their text still follows every page that shows them
+    extracted_text = ""
+    for text, xrefs in zip(page_texts, page_xrefs):
+        if text.strip():
+            extracted_text += text + "\n"
+        for xref in xrefs:
+            extracted_text += image_texts[xref]
+        extracted_text += PAGE_BREAK
+    return extracted_text
+
+
+def process_pdf(file):
+    """
+    Extract text from a PDF, OCR-ing any embedded images.
+
+    Images are indexed by xref up front so an image shared by many pages is extracted and
+    OCR'd once. Documents with at least PDF_PARALLEL_MIN_PAGES pages are split into page
+    ranges that are extracted in a pool of PDF_WORKERS processes, each with its own
+    PaddleOCR instance; each range OCRs the images that first appear in it.
+
+    Args:
+        file (file-like): The uploaded PDF.
+
+    Returns:
+        str: The extracted text, in page order.
+    """
+    pdf_bytes = file.read()
+    pdf_document = fitz.open(stream=pdf_bytes, filetype="pdf")
+    page_count = len(pdf_document)
+    page_xrefs, first_pages = _index_pdf_images(pdf_document)
+
+    if PDF_WORKERS <= 1 or page_count < PDF_PARALLEL_MIN_PAGES:
+        page_texts, image_texts = _extract_pdf_range(pdf_document, 0, page_count, list(first_pages))
+        return _assemble_pdf_text(page_texts, page_xrefs, image_texts)
+
+    pdf_document.close()
+
+    # Workers open the document from disk rather than receiving a pickled copy per range
+    with tempfile.NamedTemporaryFile(suffix='.pdf', delete=False) as pdf_file:
+        pdf_file.write(pdf_bytes)
+    try:
+        futures = []
+        for start, end in _page_ranges(page_count, PDF_WORKERS):
+            xrefs = [xref for xref, page_number in first_pages.items() if start <= page_number < end]
+            futures.append(_get_pdf_pool().submit(_extract_pdf_range_from_file, pdf_file.name, start, end, xrefs))
+
+        page_texts = []
+        image_texts = {}
+        for future in futures:
+            range_page_texts, range_image_texts = future.result()
+            page_texts.extend(range_page_texts)
+            image_texts.update(range_image_texts)
+    finally:
+        os.remove(pdf_file.name)
+
+    return _assemble_pdf_text(page_texts, page_xrefs, image_texts)
+
+
+def process_pptx(file):
+    extracted_text = []
+
+    try:
+        # Open the PowerPoint file
+        presentation = Presentation(file)
+
+        for slide in presentation.slides:
+            # Extract text from each slide
+            for shape in slide.shapes:
+                if shape.has_text_frame:
+                    for paragraph in shape.text_frame.paragraphs:
+                        for run in paragraph.runs:
+                            text = run.text.strip()
+                            if text:
+                                extracted_text.append(text + "\n")
+
+            # Extract images from each slide
+            for shape in slide.shapes:
+                if shape.shape_type == 13:  # Shape is a picture
+                    # Process the image using OCR
+                    extracted_text.append(ocr_image_bytes(shape.image.blob))
+
+            extracted_text.append(PAGE_BREAK)
+
+    except Exception as e:
+        print(f"Error processing PowerPoint file: {e}")
+        return None
+
+    return "".join(extracted_text)
+
+
+def process_image_file(file):
+    return ocr_image_bytes(file.read())
+
+
+def ocr_image_bytes(image_bytes):
+    """
+    Decode and OCR an encoded image, reusing the cached text for images seen before.
+
+    Args:
+        image_bytes (bytes): The raw encoded image (PNG, JPEG, ...).
+
+    Returns:
+        str: The extracted text.
+    """
+    key = f"{OCR_CACHE_VERSION}:{hashlib.sha256(image_bytes).hexdigest()}"
+
+    extracted_text = ocr_memory_cache.get(key)
+    if extracted_text is not None:
+        return extracted_text
+
+    if ocr_disk_cache is not None:
+        extracted_text = ocr_disk_cache.get(key)
+        if extracted_text is not None:
+            ocr_memory_cache.set(key, extracted_text)
+            return extracted_text
+
+    image_np = np.frombuffer(image_bytes, np.uint8)
+    image = cv2.imdecode(image_np, cv2.IMREAD_GRAYSCALE)
+    extracted_text = process_image(image)
+
+    ocr_memory_cache.set(key, extracted_text)
+    if ocr_disk_cache is not None:
+        ocr_disk_cache.set(key, extracted_text)
+    return extracted_text
+
+
+def ocr_cache_stats():
+    """
+    Return the hit/miss counters of both OCR cache tiers for this process.
+    """
+    return {
+        'memory': ocr_memory_cache.stats(),
+        'disk': ocr_disk_cache.stats() if ocr_disk_cache is not None else None,
+    }
+
+
+def process_image(image):
+    if image is None:
+        raise ValueError("Failed to decode the image. The file might be corrupted or the format might not be supported.")
+
+    image = cv2.copyMakeBorder(image, 10, 10, 10, 10, cv2.BORDER_CONSTANT, value=[255, 255, 255])
+    image = cv2.convertScaleAbs(image, alpha=2.0, beta=0)
+    _, image = cv2.threshold(image, 200, 255, cv2.THRESH_BINARY)
+
+    result = run_ocr(image)
+
+    extracted_text = ""
+    if result and result[0]:
+        extracted_text = ' '.join([line[1][0] for line in result[0]])
+
+    if not extracted_text.strip():
+        extracted_text = pytesseract.image_to_string(image) + "\n"
+
+    return extracted_text + "\n"
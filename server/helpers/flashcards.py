@@ -0,0 +1,334 @@
+from bson import ObjectId
+from pymongo import ASCENDING, UpdateMany, UpdateOne
+from .db import collection
+import base64
+import os
+import datetime
+
+# Flashcard storage setup. 'embedded' keeps cards in courses.concepts.concept_flashcards;
+# 'collection' keeps one document per card in the flashcards collection. Run
+# migrate_flashcards.py before switching an existing database to 'collection'.
+FLASHCARD_STORAGE = os.getenv('FLASHCARD_STORAGE', 'embedded')
+
+flashcards_collection = collection('flashcards')
+
+# Fields the store adds to every card; they are hidden from callers so cards look the same in both modes
+_STORE_FIELDS = {"_id": 0, "clerk_id": 0, "course": 0, "concept": 0, "next_due": 0}
+
+FLASHCARD_INDEXES = [
+    ([("clerk_id", ASCENDING), ("next_due", ASCENDING)], {"name": "clerk_id_next_due"}),
+    ([("clerk_id", ASCENDING), ("course", ASCENDING), ("concept", ASCENDING)], {"name": "clerk_id_course_concept"}),
+    ([("clerk_id", ASCENDING), ("id", ASCENDING)], {"name": "clerk_id_card_id", "unique": True}),
+]
+
+
+def use_flashcard_collection():
+    return FLASHCARD_STORAGE == 'collection'
+
+
+def ensure_flashcard_indexes():
+    for keys, options in FLASHCARD_INDEXES:
+        flashcards_collection.create_index(keys, **options)
+
+
+def _today():
+    return datetime.datetime.now().date().strftime("%Y-%m-%d")
+
+
+def new_card_id():
+    # An ObjectId in URL-safe base64: 16 characters instead of 24, still unique and ordered by creation
+    return base64.urlsafe_b64encode(ObjectId().binary).decode()
+
+
+def assign_card_ids(cards):
+    """
+    Give every card without an ID a new one, in place.
+
+    Cards that already have an ID keep it, so IDs stay stable across edits and migrations.
+
+    Args:
+        cards (list): The flashcards.
+
+    Returns:
+        list: The same flashcards.
+    """
+    for card in cards:
+        if not card.get('id'):
+            card['id'] = new_card_id()
+    return cards
+
+
+def card_document(clerk_id, course_name, concept_name, card):
+    """
+    Build the flashcards collection document for a card.
+
+    next_due is the earliest review date still on the card, so due cards can be found
+    with a range scan on (clerk_id, next_due).
+
+    Args:
+        clerk_id (str): The Clerk ID of the user.
+        course_name (str): The name of the course.
+        concept_name (str): The name of the concept, or None for course-level cards.
+        card (dict): The flashcard.
+
+    Returns:
+        dict: The document to store.
+    """
+    document = assign_card_ids([dict(card)])[0]
+    review_dates = document.get('review_dates') or []
+    document.update({
+        "clerk_id": clerk_id,
+        "course": course_name,
+        "concept": concept_name,
+        "next_due": min(review_dates) if review_dates else None,
+    })
+    return document
+
+
+def insert_cards(clerk_id, course_name, concept_name, cards):
+    if not cards:
+        return 0
+    # Assigned on the caller's cards too, so they can refer to them afterwards
+    assign_card_ids(cards)
+    documents = [card_document(clerk_id, course_name, concept_name, card) for card in cards]
+    result = flashcards_collection.insert_many(documents, ordered=False)
+    return len(result.inserted_ids)
+
+
+def find_cards(clerk_id, course_name=None, concept_name=None):
+    query = {"clerk_id": clerk_id}
+    if course_name is not None:
+        query["course"] = course_name
+    if concept_name is not None:
+        query["concept"] = concept_name
+    return list(flashcards_collection.find(query, _STORE_FIELDS).sort("_id", ASCENDING))
+
+
+def find_due_cards(clerk_id, course_name=None):
+    """
+    Retrieve the cards whose earliest remaining review date is today or earlier.
+
+    Args:
+        clerk_id (str): The Clerk ID of the user.
+        course_name (str, optional): Only return cards from this course.
+
+    Returns:
+        list: The due flashcards.
+    """
+    query = {"clerk_id": clerk_id, "next_due": {"$lte": _today()}}
+    if course_name is not None:
+        query["course"] = course_name
+    return list(flashcards_collection.find(query, _STORE_FIELDS))
+
+
+def find_card(clerk_id, card_id, course_name=None):
+    query = {"clerk_id": clerk_id, "id": card_id}
+    if course_name is not None:
+        query["course"] = course_name
+    return flashcards_collection.find_one(query, _STORE_FIELDS)
+
+
+def find_card_states(clerk_id, course_name, card_ids):
+    """
+    Retrieve the spaced-repetition state of the given cards.
+
+    Args:
+        clerk_id (str): The Clerk ID of the user.
+        course_name (str): The name of the course.
+        card_ids (list): The IDs of the flashcards.
+
+    Returns:
+        dict: Card ID to state, or None for cards never graded.
+    """
+    cards = flashcards_collection.find(
+        {"clerk_id": clerk_id, "course": course_name, "id": {"$in": card_ids}},
+        {"_id": 0, "id": 1, "srs": 1}
+    )
+    return {card['id']: card.get('srs') for card in cards}
+
+
+def update_card(clerk_id, card_id, update, course_name=None):
+    query = {"clerk_id": clerk_id, "id": card_id}
+    if course_name is not None:
+        query["course"] = course_name
+    return flashcards_collection.update_one(query, update).modified_count > 0
+
+
+def delete_card(clerk_id, card_id, course_name=None):
+    query = {"clerk_id": clerk_id, "id": card_id}
+    if course_name is not None:
+        query["course"] = course_name
+    return flashcards_collection.delete_one(query).deleted_count > 0
+
+
+def delete_cards(clerk_id, course_name, concept_name=None):
+    query = {"clerk_id": clerk_id, "course": course_name}
+    if concept_name is not None:
+        query["concept"] = concept_name
+    return flashcards_collection.delete_many(query).deleted_count
+
+
+def move_cards(clerk_id, course_name, new_course_name, concept_name=None, new_concept_name=None):
+    """
+    Re-point cards at a renamed course or concept.
+
+    Args:
+        clerk_id (str): The Clerk ID of the user.
+        course_name (str): The current name of the course.
+        new_course_name (str): The new name of the course.
+        concept_name (str, optional): Only move cards of this concept.
+        new_concept_name (str, optional): The new name of the concept.
+
+    Returns:
+        int: The number of cards updated.
+    """
+    query = {"clerk_id": clerk_id, "course": course_name}
+    update = {"course": new_course_name}
+    if concept_name is not None:
+        query["concept"] = concept_name
+        update["concept"] = new_concept_name or concept_name
+    return flashcards_collection.update_many(query, {"$set": update}).modified_count
+
+
+def complete_due_reviews(clerk_id, course_name=None, card_id=None):
+    """
+    Drop every review date up to and including today from due cards and recompute next_due.
+
+    Overdue dates are dropped along with today's, since reviewing a card today covers them.
+
+    Args:
+        clerk_id (str): The Clerk ID of the user.
+        course_name (str, optional): Only update cards from this course.
+        card_id (str, optional): Only update this card.
+
+    Returns:
+        bool: True if any card was updated, False otherwise.
+    """
+    today = _today()
+    query = {"clerk_id": clerk_id, "next_due": {"$lte": today}}
+    if course_name is not None:
+        query["course"] = course_name
+    if card_id is not None:
+        query["id"] = card_id
+
+    result = flashcards_collection.update_many(query, [
+        {"$set": {"review_dates": {"$filter": {
+            "input": {"$ifNull": ["$review_dates", []]},
+            "as": "date",
+            "cond": {"$gt": ["$$date", today]}
+        }}}},
+        {"$set": {"next_due": {"$min": "$review_dates"}}}
+    ])
+    return result.modified_count > 0
+
+
+def review_cards(clerk_id, course_name, reviews, seen_at):
+    """
+    Record a study session's reviews with a single bulk write.
+
+    Each card has times_seen incremented, last_seen set, every review date up to today
+    dropped, next_due recomputed and, when given, next_study_date set. A review with an 'srs'
+    state replaces the card's review dates with its due date instead.
+
+    Args:
+        clerk_id (str): The Clerk ID of the user.
+        course_name (str): The name of the course.
+        reviews (list): Dictionaries with a card_id, an optional next_study_date and an optional srs state.
+        seen_at (datetime): The time the cards were reviewed.
+
+    Returns:
+        BulkWriteResult: The result of the bulk write.
+    """
+    today = _today()
+    operations = []
+    for review in reviews:
+        fields = {
+            "times_seen": {"$add": [{"$ifNull": ["$times_seen", 0]}, 1]},
+            "last_seen": {"$literal": seen_at},
+            "review_dates": {"$filter": {
+                "input": {"$ifNull": ["$review_dates", []]},
+                "as": "date",
+                "cond": {"$gt": ["$$date", today]}
+            }},
+        }
+        if review.get('next_study_date') is not None:
+            fields["next_study_date"] = {"$literal": review['next_study_date']}
+        if review.get('srs') is not None:
+            # Graded reviews are rescheduled by the spaced-repetition engine
+            fields.update({
+                "srs": {"$literal": review['srs']},
+                "review_dates": {"$literal": [review['srs']['d']]},
+                "next_study_date": review['srs']['d'],
+            })
+        operations.append(UpdateOne(
+            {"clerk_id": clerk_id, "course": course_name, "id": review['card_id']},
+            [{"$set": fields}, {"$set": {"next_due": {"$min": "$review_dates"}}}]
+        ))
+    return flashcards_collection.bulk_write(operations, ordered=False)
+
+
+def count_cards(clerk_id, course_name):
+    return flashcards_collection.count_documents({"clerk_id": clerk_id, "course": course_name})
+
+
+def reschedule_cards(clerk_id, course_name, review_dates, exam_day):
+    """
+    Replace the review schedule of every card in a course after its exam date changed.
+
+    Cards on the fixed schedule get the given review dates; graded cards due after the exam
+    are moved onto the exam day. Both are written in one bulk write.
+
+    Args:
+        clerk_id (str): The Clerk ID of the user.
+        course_name (str): The name of the course.
+        review_dates (list): The new review dates of ungraded cards.
+        exam_day (str): The new exam date, as 'YYYY-MM-DD'.
+
+    Returns:
+        int: The number of cards modified.
+    """
+    result = flashcards_collection.bulk_write([
+        UpdateMany(
+            {"clerk_id": clerk_id, "course": course_name, "srs": {"$exists": False}},
+            {"$set": {"review_dates": review_dates, "next_due": min(review_dates) if review_dates else None}}
+        ),
+        UpdateMany(
+            {"clerk_id": clerk_id, "course": course_name, "srs.d": {"$gt": exam_day}},
+            {"$set": {"srs.d": exam_day, "review_dates": [exam_day], "next_study_date": exam_day, "next_due": exam_day}}
+        ),
+    ], ordered=False)
+    return result.modified_count
+
+
+def attach_cards(clerk_id, courses):
+    """
+    Fill in concept_flashcards on each concept of the given courses from the flashcards collection.
+
+    Course-level cards, stored without a concept, go in the course's flashcards as they do
+    when embedded.
+
+    Args:
+        clerk_id (str): The Clerk ID of the user.
+        courses (list): Course dictionaries, modified in place.
+
+    Returns:
+        list: The same courses.
+    """
+    course_names = [course['course_name'] for course in courses]
+    if not course_names:
+        return courses
+
+    cards_by_concept = {}
+    query = {"clerk_id": clerk_id, "course": {"$in": course_names}}
+    projection = {"_id": 0, "clerk_id": 0, "next_due": 0}
+    for card in flashcards_collection.find(query, projection).sort("_id", ASCENDING):
+        key = (card.pop('course'), card.pop('concept'))
+        cards_by_concept.setdefault(key, []).append(card)
+
+    for course in courses:
+        for concept in course.get('concepts', []):
+            concept['concept_flashcards'] = cards_by_concept.get((course['course_name'], concept['concept_name']), [])
+        course_cards = cards_by_concept.get((course['course_name'], None))
+        if course_cards or 'flashcards' in course:
+            course['flashcards'] = course_cards or []
+    return courses
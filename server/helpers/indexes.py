@@ -0,0 +1,190 @@
+"""
+Declared MongoDB indexes and a query-plan check for the hot queries in helpers/mongo.py.
+
+Usage:
+    python -m helpers.indexes [--ensure] [clerk_id]
+"""
+import argparse
+import datetime
+import os
+
+from pymongo import ASCENDING
+from pymongo.errors import OperationFailure
+
+from .changes import CHANGE_INDEXES
+from .db import get_db
+from .flashcards import FLASHCARD_INDEXES, use_flashcard_collection
+
+# Index setup
+ENSURE_INDEXES_ON_STARTUP = os.getenv('ENSURE_INDEXES_ON_STARTUP', 'true').lower() == 'true'
+VERIFY_QUERY_PLANS_ON_STARTUP = os.getenv('VERIFY_QUERY_PLANS_ON_STARTUP', 'false').lower() == 'true'
+
+# Error codes for an index that already exists with other options or under another name
+_INDEX_CONFLICT_CODES = (85, 86)
+
+INDEXES = {
+    'courses': [
+        ([("clerk_id", ASCENDING), ("courses.course_name", ASCENDING)], {"name": "clerk_id_course_name"}),
+        ([("clerk_id", ASCENDING), ("rev", ASCENDING)], {"name": "clerk_id_rev"}),
+        ([("clerk_id", ASCENDING), ("courses.concepts.concept_flashcards.id", ASCENDING)], {"name": "clerk_id_card_id"}),
+    ],
+    'users': [
+        ([("clerk_id", ASCENDING)], {"name": "clerk_id", "unique": True}),
+    ],
+    'due_queues': [
+        ([("clerk_id", ASCENDING)], {"name": "clerk_id", "unique": True}),
+        ([("date", ASCENDING)], {"name": "date"}),
+    ],
+    'changes': CHANGE_INDEXES,
+}
+
+
+def declared_indexes():
+    """
+    Return the indexes the server needs, by collection name.
+
+    The flashcards collection is only included when it is the flashcard storage.
+    """
+    indexes = dict(INDEXES)
+    if use_flashcard_collection():
+        indexes['flashcards'] = FLASHCARD_INDEXES
+    return indexes
+
+
+def ensure_indexes():
+    """
+    Create every declared index that does not exist yet.
+
+    create_index is a no-op for an index that already exists, so this is safe to run on
+    every startup. An index that conflicts with one created by hand is reported and skipped.
+
+    Returns:
+        list: The names of the indexes that could not be created.
+    """
+    db = get_db()
+    failed = []
+    for collection_name, indexes in declared_indexes().items():
+        for keys, options in indexes:
+            try:
+                db[collection_name].create_index(keys, **options)
+            except OperationFailure as e:
+                if e.code in _INDEX_CONFLICT_CODES:
+                    print(f"Index {collection_name}.{options['name']} already exists with different options: {e}")
+                else:
+                    print(f"Error creating index {collection_name}.{options['name']}: {e}")
+                    failed.append(f"{collection_name}.{options['name']}")
+    return failed
+
+
+def hot_queries(clerk_id):
+    """
+    The query shapes helpers/mongo.py runs on every page load, for explain().
+
+    Args:
+        clerk_id (str): The Clerk ID to plug into the queries.
+
+    Returns:
+        list: (name, collection name, filter) tuples.
+    """
+    course_name = "course"
+    today = datetime.datetime.now().date().strftime("%Y-%m-%d")
+    queries = [
+        ("get_courses", 'courses', {"clerk_id": clerk_id}),
+        ("get_course_concepts", 'courses', {"clerk_id": clerk_id, "courses.course_name": course_name}),
+        ("get_course", 'courses', {"clerk_id": clerk_id, "courses": {"$elemMatch": {"course_name": {"$regex": f"^{course_name}$", "$options": "i"}}}}),
+        ("check_premium_status", 'users', {"clerk_id": clerk_id}),
+        ("update_flashcard", 'courses', {"clerk_id": clerk_id, "courses.concepts.concept_flashcards.id": "card"}),
+        ("get_due_flashcards", 'due_queues', {"clerk_id": clerk_id}),
+    ]
+    if use_flashcard_collection():
+        queries += [
+            ("rebuild_due_queue", 'flashcards', {"clerk_id": clerk_id, "next_due": {"$lte": today}}),
+            ("get_flashcards", 'flashcards', {"clerk_id": clerk_id, "course": course_name, "concept": "concept"}),
+            ("get_times_seen", 'flashcards', {"clerk_id": clerk_id, "id": "card"}),
+        ]
+    return queries
+
+
+def _plan_stages(plan):
+    # Every stage name in an explain() plan tree
+    stages = []
+    if isinstance(plan, dict):
+        if 'stage' in plan:
+            stages.append(plan['stage'])
+        for value in plan.values():
+            stages += _plan_stages(value)
+    elif isinstance(plan, list):
+        for value in plan:
+            stages += _plan_stages(value)
+    return stages
+
+
+def explain_hot_queries(clerk_id="explain-probe"):
+    """
+    Run explain() on the hot queries and flag the ones whose winning plan is a collection scan.
+
+    Args:
+        clerk_id (str): The Clerk ID to plug into the queries.
+
+    Returns:
+        list: A dictionary per query with its name, collection, plan stages and collscan flag.
+    """
+    db = get_db()
+    results = []
+    for name, collection_name, query in hot_queries(clerk_id):
+        explanation = db[collection_name].find(query).explain()
+        stages = _plan_stages(explanation.get('queryPlanner', {}).get('winningPlan', {}))
+        results.append({
+            'name': name,
+            'collection': collection_name,
+            'stages': stages,
+            'collscan': 'COLLSCAN' in stages,
+        })
+    return results
+
+
+def verify_query_plans(clerk_id="explain-probe"):
+    collscans = [result for result in explain_hot_queries(clerk_id) if result['collscan']]
+    for result in collscans:
+        print(f"Warning: {result['name']} scans the whole {result['collection']} collection")
+    return not collscans
+
+
+def bootstrap_indexes():
+    """
+    Create the declared indexes, and optionally check the query plans, on server startup.
+
+    Failures are printed rather than raised so the server still starts when the database
+    is unreachable or the user lacks the createIndex privilege.
+    """
+    try:
+        if ENSURE_INDEXES_ON_STARTUP:
+            ensure_indexes()
+        if VERIFY_QUERY_PLANS_ON_STARTUP:
+            verify_query_plans()
+    except Exception as e:
+        print(f"Error bootstrapping indexes: {e}")
+
+
+def main():
+    parser = argparse.ArgumentParser(description=__doc__, formatter_class=argparse.RawDescriptionHelpFormatter)
+    parser.add_argument('clerk_id', nargs='?', default="explain-probe", help="Clerk ID to plug into the queries")
+    parser.add_argument('--ensure', action='store_true', help="Create the declared indexes first")
+    args = parser.parse_args()
+
+    if args.ensure:
+        failed = ensure_indexes()
+        print(f"Indexes ensured ({len(failed)} failed)")
+
+    results = explain_hot_queries(args.clerk_id)
+    print(f"{'query':<24}{'collection':<14}plan")
+    for result in results:
+        flag = "  <-- COLLSCAN" if result['collscan'] else ""
+        print(f"{result['name']:<24}{result['collection']:<14}{' > '.join(result['stages'])}{flag}")
+
+    if any(result['collscan'] for result in results):
+        raise SystemExit(1)
+
+
+if __name__ == "__main__":
+    main()
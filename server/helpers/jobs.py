@@ -0,0 +1,173 @@
+import os
+import threading
+import time
+import traceback
+import uuid
+from concurrent.futures import ThreadPoolExecutor
+
+# Background job setup
+JOB_WORKERS = int(os.getenv('JOB_WORKERS', '2'))
+JOB_RETENTION_SECONDS = int(os.getenv('JOB_RETENTION_SECONDS', '3600'))
+
+_jobs = {}
+_active_jobs_by_key = {}
+_jobs_lock = threading.Lock()
+
+
+class Job:
+    """
+    A unit of background work with named stages.
+
+    The job function receives the Job as its first argument and calls
+    `start_stage` as it moves through its stages, so pollers can see
+    which stage is running and which ones are done.
+    """
+
+    def __init__(self, stages, key=None):
+        self.id = uuid.uuid4().hex
+        self.key = key
+        self.status = 'queued'
+        self.stages = {stage: 'pending' for stage in stages}
+        self.current_stage = None
+        self.result = None
+        self.error = None
+        self.created_at = time.time()
+        self.started_at = None
+        self.finished_at = None
+
+    def start_stage(self, stage):
+        """
+        Mark the current stage as done and the given stage as running.
+
+        Args:
+            stage (str): The name of the stage being started.
+
+        Returns:
+            None
+        """
+        with _jobs_lock:
+            if self.current_stage is not None:
+                self.stages[self.current_stage] = 'done'
+            self.stages[stage] = 'running'
+            self.current_stage = stage
+
+    def to_dict(self):
+        with _jobs_lock:
+            return {
+                'job_id': self.id,
+                'status': self.status,
+                'current_stage': self.current_stage,
+                'stages': [{'name': name, 'status': status} for name, status in self.stages.items()],
+                'error': self.error,
+                'created_at': self.created_at,
+                'started_at': self.started_at,
+                'finished_at': self.finished_at,
+            }
+
+
+class ProcessThreadPool:
+    """
+    A thread pool built on first use in each process.
+
+    Executors do not survive a fork, so every worker process builds its own. The pool is
+    created under a lock, so request threads racing to first use it share one.
+
+    Args:
+        max_workers (int): The number of threads in the pool.
+        thread_name_prefix (str): The prefix of the pool's thread names.
+    """
+
+    def __init__(self, max_workers, thread_name_prefix):
+        self.max_workers = max_workers
+        self.thread_name_prefix = thread_name_prefix
+        self._executor = None
+        self._pid = None
+        self._lock = threading.Lock()
+
+    def get(self):
+        """
+        Return this process's executor, creating it on first use.
+        """
+        with self._lock:
+            if self._executor is None or self._pid != os.getpid():
+                self._executor = ThreadPoolExecutor(max_workers=self.max_workers, thread_name_prefix=self.thread_name_prefix)
+                self._pid = os.getpid()
+            return self._executor
+
+
+_executor = ProcessThreadPool(JOB_WORKERS, 'job')
+
+
+def _run_job(job, fn, args, kwargs):
+    with _jobs_lock:
+        job.status = 'running'
+        job.started_at = time.time()
+    try:
+        result = fn(job, *args, **kwargs)
+        with _jobs_lock:
+            if job.current_stage is not None:
+                job.stages[job.current_stage] = 'done'
+            job.result = result
+            job.status = 'completed'
+    except Exception as e:
+        print(f"Error in job {job.id}: {e}")
+        print(f"Traceback: {traceback.format_exc()}")
+        with _jobs_lock:
+            if job.current_stage is not None:
+                job.stages[job.current_stage] = 'failed'
+            job.error = str(e)
+            job.status = 'failed'
+    finally:
+        with _jobs_lock:
+            job.finished_at = time.time()
+            if job.key is not None and _active_jobs_by_key.get(job.key) is job:
+                del _active_jobs_by_key[job.key]
+
+
+def _prune_jobs():
+    cutoff = time.time() - JOB_RETENTION_SECONDS
+    with _jobs_lock:
+        expired = [job_id for job_id, job in _jobs.items() if job.finished_at and job.finished_at < cutoff]
+        for job_id in expired:
+            del _jobs[job_id]
+
+
+def submit_job(fn, stages, *args, key=None, **kwargs):
+    """
+    Run a function in the background job pool.
+
+    Args:
+        fn (callable): Called as fn(job, *args, **kwargs). Its return value becomes the job result.
+        stages (list): The ordered stage names the job will report.
+        key (str, optional): Identifies jobs that compute the same result. While a job with the
+            same key is queued or running, that job is returned instead of starting another.
+
+    Returns:
+        Job: The queued job, or the in-flight job with the same key.
+    """
+    _prune_jobs()
+    with _jobs_lock:
+        if key is not None and key in _active_jobs_by_key:
+            return _active_jobs_by_key[key]
+        job = Job(stages, key)
+        _jobs[job.id] = job
+        if key is not None:
+            _active_jobs_by_key[key] = job
+    _executor.get().submit(_run_job, job, fn, args, kwargs)
+    return job
+
+
+def get_job(job_id):
+    """
+    Retrieve a job by its ID.
+
+    Job state is kept in the memory of the worker process that accepted the job.
+
+    Args:
+        job_id (str): The ID of the job.
+
+    Returns:
+        Job or None: The job if found, None otherwise.
+    """
+    with _jobs_lock:
+        return _jobs.get(job_id)
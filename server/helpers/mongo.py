@@ -1,7 +1,16 @@
-from bson import ObjectId
+from pymongo import ReturnDocument, UpdateOne
 from dotenv import load_dotenv
-from pymongo import MongoClient
-from .util import generate_review_dates
+from .db import db, collection
+from .util import generate_review_dates, generate_review_schedules, parse_exam_date
+from .cache import LRUCache
+from . import flashcards as flashcard_store
+from . import due_queue
+from . import srs
+from . import changes
+import bson
+import copy
+import functools
+import inspect
 import os
 import datetime
 import openai
@@ -10,11 +19,31 @@ import urllib.parse
 load_dotenv()
 
 # MongoDB setup
-mongo_uri = os.getenv('MONGO_URI')
-client = MongoClient(mongo_uri)
-db = client['VeidaAI']
-courses_collection = db['courses']
-users_collection = db['users']
+courses_collection = collection('courses')
+users_collection = collection('users')
+
+# Premium status cache. Entries expire after PREMIUM_CACHE_TTL_SECONDS and are dropped as soon
+# as this process changes a user's premium status.
+PREMIUM_CACHE_SIZE = int(os.getenv('PREMIUM_CACHE_SIZE', '10000'))
+PREMIUM_CACHE_TTL_SECONDS = int(os.getenv('PREMIUM_CACHE_TTL_SECONDS', '60'))
+premium_cache = LRUCache(maxsize=PREMIUM_CACHE_SIZE, ttl=PREMIUM_CACHE_TTL_SECONDS)
+
+# Course read cache. Each user's courses document carries a `rev` counter that every write
+# helper below increments; cached reads are tagged with the rev they were read at and are
+# only served while it is still current, so all workers see each other's writes.
+COURSE_CACHE_ENABLED = os.getenv('COURSE_CACHE_ENABLED', 'true').lower() == 'true'
+COURSE_CACHE_SIZE = int(os.getenv('COURSE_CACHE_SIZE', '10000'))
+COURSE_CACHE_MAX_BYTES = int(os.getenv('COURSE_CACHE_MAX_BYTES', str(128 * 1024 * 1024)))
+course_cache = LRUCache(
+    maxsize=COURSE_CACHE_SIZE,
+    max_bytes=COURSE_CACHE_MAX_BYTES,
+    sizeof=lambda entry: len(bson.encode({"value": entry[1]}))
+)
+
+# Study writes to single cards (update_lastseen, update_times_seen and the like, one request per
+# card flip) do not move the rev, and with it every cached read and ETag of the user, at each
+# flip. They add their change log entries to the courses document's pending_changes instead, and
+# the next read of the rev, or the next write, records them all under one rev.
 
 #!Database reformate purposes
 #courses_collection = db["courses_test"]
@@ -23,6 +52,150 @@ users_collection = db['users']
 openai_api_key = os.getenv('OPENAI_API_KEY')
 openai_client = openai.OpenAI(api_key=openai_api_key)
 
+def get_course_rev(clerk_id):
+    """
+    Retrieve the revision of a user's courses document.
+
+    Study writes still pending are recorded first, so the revision covers every write made
+    so far by any worker.
+
+    Args:
+        clerk_id (str): The Clerk ID of the user.
+
+    Returns:
+        int or None: The revision, or None if the user has no courses document.
+    """
+    user = courses_collection.find_one({"clerk_id": clerk_id}, {"_id": 0, "rev": 1, "pending_changes": 1})
+    if user is None:
+        return None
+    if user.get('pending_changes'):
+        return record_write(clerk_id, [])
+    return user.get('rev') or 0
+
+
+def record_write(clerk_id, changed=None):
+    """
+    Bump the user's revision and log what changed at it.
+
+    Cached reads of the user are refetched by every worker once the revision moves, and
+    clients syncing from an older revision are sent the logged entities. The user's pending
+    study writes are taken in the same update and logged at the same revision.
+
+    Args:
+        clerk_id (str): The Clerk ID of the user.
+        changed (list, optional): The changed courses, concepts and cards. None means anything may have changed.
+
+    Returns:
+        int or None: The new revision, or None if the user has no courses document.
+    """
+    # The document before the update carries the pending study writes this bump takes
+    user = courses_collection.find_one_and_update(
+        {"clerk_id": clerk_id},
+        {"$inc": {"rev": 1}, "$currentDate": {"rev_at": True}, "$unset": {"pending_changes": ""}},
+        projection={"_id": 0, "rev": 1, "pending_changes": 1},
+        return_document=ReturnDocument.BEFORE
+    )
+    if user is None:
+        return None
+    rev = (user.get('rev') or 0) + 1
+    pending = user.get('pending_changes') or []
+    if pending and changed is not None:
+        changed = pending + [change for change in changed if change not in pending]
+    try:
+        changes.log_changes(clerk_id, rev, changed)
+    except Exception as e:
+        # Syncing clients treat the missing entry as lost and reload the affected courses
+        print(f"Error logging changes for clerk_id {clerk_id}: {e}")
+    return rev
+
+
+def _queue_study_write(clerk_id, changed):
+    # Left for the next read of the rev or the next write to record, see record_write
+    courses_collection.update_one(
+        {"clerk_id": clerk_id},
+        {"$addToSet": {"pending_changes": {"$each": changed}}}
+    )
+
+
+def _written_entities(scope, arguments):
+    # The entities a write helper touched, named from its arguments, for the change log
+    if scope is None:
+        return None
+    if scope == 'course':
+        course_names = dict.fromkeys(arguments[name] for name in ('original_course_name', 'course_name') if arguments.get(name))
+        return [{"course": course_name} for course_name in course_names]
+
+    course_name = arguments['course_name']
+    if scope == 'concept':
+        concept_names = dict.fromkeys(arguments[name] for name in ('original_concept_name', 'concept_name') if arguments.get(name))
+        return [{"course": course_name, "concept": concept_name} for concept_name in concept_names]
+    if scope == 'card':
+        return [{"course": course_name, "card": arguments['card_id']}]
+    return [{"course": course_name, "card": review.get('card_id')} for review in arguments.get('reviews') or []]
+
+
+def _records_write(scope=None, study=False):
+    """
+    Decorate a write helper taking clerk_id first, so it records the write once it returns.
+
+    A helper that raises records nothing, so the error reaches the caller unchanged.
+
+    Args:
+        scope (str, optional): What the helper writes to: 'course', 'concept', 'card' or 'cards'
+            (a study session's reviews). The entities are named by the helper's course_name,
+            concept_name and card_id arguments. None means anything may have changed.
+        study (bool, optional): Whether the helper is a study write to a single card, left
+            pending and recorded together with the others.
+    """
+    def decorate(write):
+        signature = inspect.signature(write)
+
+        @functools.wraps(write)
+        def wrapper(clerk_id, *args, **kwargs):
+            arguments = signature.bind(clerk_id, *args, **kwargs).arguments
+            result = write(clerk_id, *args, **kwargs)
+            if study:
+                _queue_study_write(clerk_id, _written_entities(scope, arguments))
+            else:
+                record_write(clerk_id, _written_entities(scope, arguments))
+            return result
+        return wrapper
+    return decorate
+
+
+def _cached_read(clerk_id, key, read):
+    """
+    Serve a read of a user's courses from the cache while the user's revision is unchanged.
+
+    The revision is read before the data, so a write that lands in between leaves the
+    entry tagged with the old revision and it is refetched on the next read.
+
+    Args:
+        clerk_id (str): The Clerk ID of the user.
+        key (tuple): Identifies the read among the user's reads.
+        read (callable): Reads the value from the database.
+
+    Returns:
+        A copy of the value, so callers may modify it.
+    """
+    if not COURSE_CACHE_ENABLED:
+        return read()
+    rev = get_course_rev(clerk_id)
+    if rev is None:
+        return read()
+
+    entry = course_cache.get((clerk_id, key))
+    if entry is None or entry[0] != rev:
+        entry = (rev, read())
+        course_cache.set((clerk_id, key), entry)
+    return copy.deepcopy(entry[1])
+
+
+def course_cache_stats():
+    return course_cache.stats()
+
+
+@_records_write()
 def reformat_courses_collection_user(clerk_id):
     user_courses = courses_collection.find_one({"clerk_id": clerk_id})
 
@@ -210,12 +383,53 @@ def update_premium_status(clerk_id, premium):
         {'clerk_id': clerk_id},
         {'$set': {'premium': premium}}
     )
+    invalidate_premium_status(clerk_id)
     if result.modified_count == 0:
         print(f"No document found with clerk_id: {clerk_id}")
     else:
         print(f"Updated premium status for clerk_id: {clerk_id}")
         print(f"Update result: {result.raw_result}")
         
+def invalidate_premium_status(clerk_id):
+    premium_cache.delete(clerk_id)
+
+
+def get_premium_status(clerk_id):
+    """
+    Check the premium status of a user, updating it if expired, through the premium cache.
+
+    Args:
+        clerk_id (str): The Clerk ID of the user.
+
+    Returns:
+        bool or None: Whether the user is premium, or None if the user is not found.
+    """
+    cached = premium_cache.get(clerk_id)
+    if cached is not None:
+        return cached
+
+    print(f"Checking premium status for clerk_id: {clerk_id}")
+    user = users_collection.find_one({'clerk_id': clerk_id}, {'_id': 0, 'premium': 1, 'premium_expiry': 1})
+    if not user:
+        return None
+
+    is_premium = user.get('premium') == True
+    premium_expiry = user.get('premium_expiry')
+    if is_premium and premium_expiry is not None:
+        if isinstance(premium_expiry, str):
+            premium_expiry = datetime.datetime.strptime(premium_expiry, '%Y-%m-%d')
+        if premium_expiry < datetime.datetime.now():
+            # Premium has expired, update the user's premium status
+            users_collection.update_one(
+                {'clerk_id': clerk_id},
+                {'$set': {'premium': False, 'premium_expiry': None}}
+            )
+            is_premium = False
+
+    premium_cache.set(clerk_id, is_premium)
+    return is_premium
+
+
 def check_premium_status(clerk_id):
     """
     Check the premium status of a user and update it if expired.
@@ -226,28 +440,7 @@ def check_premium_status(clerk_id):
     Returns:
         bool: True if the user is premium, False otherwise.
     """
-    print(f"Checking premium status for clerk_id: {clerk_id}")  # Add this line
-    #users_collection = db.users
-    user = users_collection.find_one({'clerk_id': clerk_id})
-
-    if user:
-        print(f"User found: {user}")  # Add this line
-        if 'premium' in user and user['premium'] == True:
-            # Check if the premium status has expired
-            if 'premium_expiry' in user:
-                premium_expiry = user['premium_expiry']
-                if premium_expiry is not None:
-                    if isinstance(premium_expiry, str):
-                        premium_expiry = datetime.strptime(premium_expiry, '%Y-%m-%d')
-                    if premium_expiry < datetime.now():
-                        # Premium has expired, update the user's premium status
-                        users_collection.update_one(
-                            {'clerk_id': clerk_id},
-                            {'$set': {'premium': False, 'premium_expiry': None}}
-                        )
-                        return False
-            return True
-    return False
+    return get_premium_status(clerk_id) == True
 
 
 def create_user(user_data):
@@ -275,6 +468,7 @@ def create_user(user_data):
 
 
 
+@_records_write("card", study=True)
 def remove_today_review_date(clerk_id, course_name, card_id):
     """
     Remove today's review date from a specific flashcard.
@@ -287,13 +481,52 @@ def remove_today_review_date(clerk_id, course_name, card_id):
     Returns:
         bool: True if the operation was successful, False otherwise.
     """
+    due_queue.dequeue_cards(clerk_id, card_id=card_id)
+    if flashcard_store.use_flashcard_collection():
+        return flashcard_store.complete_due_reviews(clerk_id, course_name, card_id)
+
     today = datetime.datetime.now().date().strftime("%Y-%m-%d")
-    result = courses_collection.update_one(
-        {"clerk_id": clerk_id, "courses.course_name": course_name, "courses.flashcards.id": card_id},
-        {"$pull": {"courses.$[course].flashcards.$[card].review_dates": today}},
-        array_filters=[{"course.course_name": course_name}, {"card.id": card_id}]
+    return _update_course_card(clerk_id, course_name, card_id, {"$pull": {"review_dates": today}})
+
+
+def _update_course_card(clerk_id, course_name, card_id, update):
+    """
+    Apply an update to one embedded flashcard, addressed by its ID.
+
+    Cards live in their concept's concept_flashcards; cards added with add_flashcard live in
+    the course's own flashcards array. The query is served by the clerk_id_card_id index and
+    the array filters only touch the concept and card holding the ID.
+
+    Args:
+        clerk_id (str): The Clerk ID of the user.
+        course_name (str): The name of the course.
+        card_id (str): The ID of the flashcard.
+        update (dict): An update document on card fields, e.g. {"$inc": {"times_seen": 1}}.
+
+    Returns:
+        bool: True if the flashcard was modified, False otherwise.
+    """
+    locations = (
+        ("courses.$[course].concepts.$[concept].concept_flashcards.$[card]", "concepts.concept_flashcards.id",
+         [{"concept.concept_flashcards.id": card_id}]),
+        ("courses.$[course].flashcards.$[card]", "flashcards.id", []),
     )
-    return result.modified_count > 0
+    for card_path, id_field, concept_filters in locations:
+        card_update = {
+            operator: {f"{card_path}.{field}": value for field, value in fields.items()}
+            for operator, fields in update.items() if fields
+        }
+        if not card_update:
+            return False
+        result = courses_collection.update_one(
+            {"clerk_id": clerk_id, "courses": {"$elemMatch": {"course_name": course_name, id_field: card_id}}},
+            card_update,
+            array_filters=[{"course.course_name": course_name}, *concept_filters, {"card.id": card_id}]
+        )
+        if result.matched_count:
+            return result.modified_count > 0
+    return False
+
 
 def update_user(user_data):
     """
@@ -328,8 +561,10 @@ def delete_user(user_data):
     """
     users_collection = db.users
     users_collection.delete_one({'clerk_id': user_data['id']})
+    invalidate_premium_status(user_data['id'])
 
 
+@_records_write("course")
 def make_course(clerk_id, course_name, description, exam_date ):
     """
     Create a new course for a user.
@@ -362,6 +597,7 @@ def make_course(clerk_id, course_name, description, exam_date ):
         upsert=True
     )
     
+@_records_write("course")
 def create_or_update_notes(clerk_id, course_name, notes, notes_name):
     """
     Create or update notes for a specific course.
@@ -382,6 +618,7 @@ def create_or_update_notes(clerk_id, course_name, notes, notes_name):
     )
     return result.matched_count > 0 or result.upserted_id is not None
 
+@_records_write("course")
 def delete_notes(clerk_id, course_name, notes_name):
     """
     Delete specific notes for a course.
@@ -437,6 +674,7 @@ def get_note_by_name(clerk_id, course_name, note_name):
                 return course['notes'].get(note_name)
     return None
 
+@_records_write("course")
 def add_flashcard(clerk_id, course_name, front, back):
     """
     Add a new flashcard to a course.
@@ -450,12 +688,16 @@ def add_flashcard(clerk_id, course_name, front, back):
     Returns:
         None
     """
-    new_card = {"id": str(ObjectId()), "front": front, "back": back, "last_seen": None}
+    new_card = {"id": flashcard_store.new_card_id(), "front": front, "back": back, "last_seen": None}
+    if flashcard_store.use_flashcard_collection():
+        flashcard_store.insert_cards(clerk_id, course_name, None, [new_card])
+        return
     courses_collection.update_one(
         {"clerk_id": clerk_id, "courses.course_name": course_name},
         {"$push": {"courses.$.flashcards": new_card}}
     )
 
+@_records_write("card")
 def remove_flashcard(clerk_id, course_name, card_id):
     """
     Remove a flashcard from a course.
@@ -468,38 +710,135 @@ def remove_flashcard(clerk_id, course_name, card_id):
     Returns:
         None
     """
-    courses_collection.update_one(
-        {"clerk_id": clerk_id, "courses.course_name": course_name},
-        {"$pull": {"courses.$.flashcards": {"id": card_id}}}
-    )
+    due_queue.dequeue_cards(clerk_id, card_id=card_id)
+    if flashcard_store.use_flashcard_collection():
+        flashcard_store.delete_card(clerk_id, card_id, course_name)
+        return
+    # Cards added by add_flashcard live on the course itself, which may have no concepts array yet,
+    # and MongoDB refuses array updates through a missing path
+    courses_collection.bulk_write([
+        UpdateOne(
+            {"clerk_id": clerk_id, "courses.course_name": course_name},
+            {"$pull": {"courses.$[course].flashcards": {"id": card_id}}},
+            array_filters=[{"course.course_name": course_name}]
+        ),
+        UpdateOne(
+            {"clerk_id": clerk_id, "courses.course_name": course_name},
+            {"$pull": {"courses.$[course].concepts.$[concept].concept_flashcards": {"id": card_id}}},
+            array_filters=[
+                {"course.course_name": course_name, "course.concepts": {"$type": "array"}},
+                {"concept.concept_flashcards.id": card_id}
+            ]
+        ),
+    ], ordered=False)
     
     
+def _first_match(array, field, value):
+    # Aggregation expression for the first element of `array` whose `field` equals `value`
+    return {"$arrayElemAt": [
+        {"$filter": {"input": {"$ifNull": [array, []]}, "as": "item", "cond": {"$eq": [f"$$item.{field}", value]}}},
+        0
+    ]}
+
+
+def _find_concept_field(clerk_id, course_name, concept_name, value_expression):
+    """
+    Evaluate an aggregation expression against a single concept on the server.
+
+    Only the result of the expression is sent back, rather than the user's whole courses document.
+
+    Args:
+        clerk_id (str): The Clerk ID of the user.
+        course_name (str): The name of the course.
+        concept_name (str): The name of the concept.
+        value_expression (dict or str): An expression over "$concept".
+
+    Returns:
+        The value of the expression, or None if the course or concept is not found.
+    """
+    result = list(courses_collection.aggregate([
+        {"$match": {"clerk_id": clerk_id, "courses.course_name": course_name}},
+        {"$project": {"_id": 0, "course": _first_match("$courses", "course_name", course_name)}},
+        {"$project": {"concept": _first_match("$course.concepts", "concept_name", concept_name)}},
+        {"$match": {"concept": {"$exists": True}}},
+        {"$project": {"value": value_expression}}
+    ]))
+    if not result:
+        return None
+    return result[0].get('value')
+
+
+def _course_cards(course):
+    # Aggregation expression for every flashcard of `course`: the legacy course-level cards
+    # followed by each concept's cards
+    return {"$concatArrays": [
+        {"$ifNull": [f"{course}.flashcards", []]},
+        {"$reduce": {
+            "input": {"$ifNull": [f"{course}.concepts", []]},
+            "initialValue": [],
+            "in": {"$concatArrays": ["$$value", {"$ifNull": ["$$this.concept_flashcards", []]}]}
+        }}
+    ]}
+
+
+def _find_course_field(clerk_id, course_name, value_expression):
+    """
+    Evaluate an aggregation expression against a single course on the server.
+
+    Args:
+        clerk_id (str): The Clerk ID of the user.
+        course_name (str): The name of the course.
+        value_expression (dict or str): An expression over "$course".
+
+    Returns:
+        The value of the expression, or None if the course is not found.
+    """
+    result = list(courses_collection.aggregate([
+        {"$match": {"clerk_id": clerk_id, "courses.course_name": course_name}},
+        {"$project": {"_id": 0, "course": _first_match("$courses", "course_name", course_name)}},
+        {"$match": {"course": {"$exists": True}}},
+        {"$project": {"value": value_expression}}
+    ]))
+    if not result:
+        return None
+    return result[0].get('value')
+
+
+def _find_course_card(clerk_id, course_name, card_id):
+    """
+    Retrieve a single flashcard of a course by its ID, searching every concept on the server.
+
+    Args:
+        clerk_id (str): The Clerk ID of the user.
+        course_name (str): The name of the course.
+        card_id (str): The ID of the flashcard.
+
+    Returns:
+        dict or None: The flashcard if found, None otherwise.
+    """
+    if flashcard_store.use_flashcard_collection():
+        return flashcard_store.find_card(clerk_id, card_id, course_name)
+
+    return _find_course_field(clerk_id, course_name, _first_match(_course_cards("$course"), "id", card_id))
+
+
 def get_mcqs(clerk_id, course_name,concept_name):
     
-    user_courses = courses_collection.find_one({"clerk_id": clerk_id})
-    user_profile = users_collection.find_one({"clerk_id": clerk_id})
-    if not user_courses:
+    # Check if the user is premium
+    is_premium = get_premium_status(clerk_id)
+    if is_premium is None:
         print(f"User not found for clerk_id: {clerk_id}")
         return []
 
-    # Check if the user is premium
-    #is_premium = user_courses.get('premium', False)
-    
-    is_premium = user_profile.get('premium', False)
     concept_name = decode_url_like_string(concept_name)
     course_name = decode_url_like_string(course_name)
 
-    if user_courses and 'courses' in user_courses:
-        for course in user_courses['courses']:
-            if course['course_name'] == course_name:
-                for concept in course.get('concepts', []):
-                    if concept['concept_name'] == concept_name:
-                        
-                        if not is_premium:
-                            return concept['concept_multiple_choice_questions'][:3]
-                        else:
-                            return concept['concept_multiple_choice_questions']
-    return []
+    mcqs = {"$ifNull": ["$concept.concept_multiple_choice_questions", []]}
+    if not is_premium:
+        # Free users only get the first three questions, so don't transfer the rest
+        mcqs = {"$slice": [mcqs, 3]}
+
+    return _find_concept_field(clerk_id, course_name, concept_name, mcqs) or []
 
 
 
@@ -518,15 +857,13 @@ def get_flashcards(clerk_id, course_name,concept_name):
     """
     concept_name = decode_url_like_string(concept_name)
     course_name = decode_url_like_string(course_name)
-    
-    user_courses = courses_collection.find_one({"clerk_id": clerk_id})
-    if user_courses and 'courses' in user_courses:
-        for course in user_courses['courses']:
-            if course['course_name'] == course_name:
-                for concept in course.get('concepts', []):
-                    if concept['concept_name'] == concept_name:
-                        return concept['concept_flashcards']
-    return None
+    return _cached_read(clerk_id, ("flashcards", course_name, concept_name), lambda: _read_flashcards(clerk_id, course_name, concept_name))
+
+
+def _read_flashcards(clerk_id, course_name, concept_name):
+    if flashcard_store.use_flashcard_collection():
+        return flashcard_store.find_cards(clerk_id, course_name, concept_name)
+    return _find_concept_field(clerk_id, course_name, concept_name, "$concept.concept_flashcards")
 
 def decode_url_like_string(url_like_string):
     decoded = urllib.parse.unquote(url_like_string)
@@ -535,17 +872,8 @@ def decode_url_like_string(url_like_string):
 
 
 def get_due_flashcards(clerk_id):
-    today = datetime.datetime.now().date().strftime("%Y-%m-%d") 
-    user = courses_collection.find_one({"clerk_id":clerk_id})
-    
-    due_flashcards = []
-    for course in user['courses']:
-        for concept in course.get('concepts', []):
-            for flashcard in concept['concept_flashcards']:
-                if today in flashcard.get('review_dates', []):
-                    due_flashcards.append(flashcard)
-
-    return due_flashcards
+    # Read from the user's materialized due queue instead of scanning every card
+    return due_queue.get_due_cards(clerk_id)
 
              
 
@@ -553,9 +881,34 @@ def get_due_flashcards(clerk_id):
 
 
 
+def count_courses(clerk_id):
+    """
+    Count a user's courses without loading them.
+
+    Args:
+        clerk_id (str): The Clerk ID of the user.
+
+    Returns:
+        int: The number of courses.
+    """
+    result = list(courses_collection.aggregate([
+        {"$match": {"clerk_id": clerk_id}},
+        {"$project": {"_id": 0, "count": {"$size": {"$ifNull": ["$courses", []]}}}}
+    ]))
+    if not result:
+        return 0
+    return result[0]['count']
+
+
 def get_courses(clerk_id):
+    return _cached_read(clerk_id, ("courses",), lambda: _read_courses(clerk_id))
+
+
+def _read_courses(clerk_id):
     user = courses_collection.find_one({"clerk_id": clerk_id})
     if user:
+        if flashcard_store.use_flashcard_collection():
+            return flashcard_store.attach_cards(clerk_id, user.get('courses', []))
         return user.get('courses', [])
     return []
 
@@ -563,13 +916,20 @@ import traceback
 
 
 
+@_records_write("concept")
 def add_concept(clerk_id,course_name,concept_name,concept_description,concept_mcqs,concept_flashcards,concept_notes):
+    flashcard_store.assign_card_ids(concept_flashcards or [])
+    embedded_flashcards = concept_flashcards
+    if flashcard_store.use_flashcard_collection():
+        flashcard_store.insert_cards(clerk_id, course_name, concept_name, concept_flashcards)
+        embedded_flashcards = []
     courses_collection.update_one(
         {"clerk_id": clerk_id, "courses.course_name": course_name},
         {"$push": {"courses.$.concepts": {"concept_name": concept_name, "concept_description": concept_description,
-         "concept_multiple_choice_questions": concept_mcqs, "concept_flashcards": concept_flashcards, "concept_notes": concept_notes}}}
+         "concept_multiple_choice_questions": concept_mcqs, "concept_flashcards": embedded_flashcards, "concept_notes": concept_notes}}}
 
     )
+    due_queue.queue_cards(clerk_id, course_name, concept_name, concept_flashcards or [])
 def add_course_concept_content(clerk_id, course_name, concept_name, new_notes, new_flashcards, new_mcqs):
     try:
         # First, find the existing course for the given clerk_id and course_name
@@ -590,61 +950,85 @@ def add_course_concept_content(clerk_id, course_name, concept_name, new_notes, n
             print(f"Concept {concept_name} not found in course {course_name}")
             return False
 
-        # Initialize update operations
-        update_operation = {"$set": {}, "$push": {}}
+        # The names are matched case-insensitively, so write and log under the stored ones
+        return _add_concept_content(
+            clerk_id, target_course['course_name'], target_concept['concept_name'],
+            target_course, target_concept, new_notes, new_flashcards, new_mcqs
+        )
 
-        # Handle new notes: Append if the notes are a string or push into the array if they are not
-        if new_notes:
-            if isinstance(target_concept.get('concept_notes'), str):
-                # If notes are a string, concatenate the new notes with a newline
-                update_operation["$set"]["courses.$[course].concepts.$[concept].concept_notes"] = target_concept['concept_notes'] + "\n\n" + new_notes
-            else:
-                # If notes are an array, push the new notes into it
-                update_operation["$push"]["courses.$[course].concepts.$[concept].concept_notes"] = new_notes
+    except Exception as e:
+        print(f"Error adding course concept content: {str(e)}")
+        print(f"Traceback: {traceback.format_exc()}")
+        return False
 
-        # Handle new flashcards: Add the new flashcards and initialize review dates and times_seen
-        if new_flashcards:
-            for flashcard in new_flashcards:
-                flashcard['review_dates'] = generate_review_dates(datetime.datetime.now(), target_course['exam_date'])
-                flashcard['times_seen'] = 0
+
+@_records_write("concept")
+def _add_concept_content(clerk_id, course_name, concept_name, target_course, target_concept, new_notes, new_flashcards, new_mcqs):
+    # Initialize update operations
+    update_operation = {"$set": {}, "$push": {}}
+    cards_added = 0
+
+    # Handle new notes: Append if the notes are a string or push into the array if they are not
+    if new_notes:
+        if isinstance(target_concept.get('concept_notes'), str):
+            # If notes are a string, concatenate the new notes with a newline
+            update_operation["$set"]["courses.$[course].concepts.$[concept].concept_notes"] = target_concept['concept_notes'] + "\n\n" + new_notes
+        else:
+            # If notes are an array, push the new notes into it
+            update_operation["$push"]["courses.$[course].concepts.$[concept].concept_notes"] = new_notes
+
+    # Handle new flashcards: Add the new flashcards and initialize review dates and times_seen
+    if new_flashcards:
+        # One schedule computation for the whole batch; the exam date is parsed once
+        review_schedules = generate_review_schedules(datetime.datetime.now(), [target_course['exam_date']] * len(new_flashcards))
+        for flashcard, review_dates in zip(new_flashcards, review_schedules):
+            flashcard['review_dates'] = review_dates
+            flashcard['times_seen'] = 0
+        flashcard_store.assign_card_ids(new_flashcards)
+        if flashcard_store.use_flashcard_collection():
+            cards_added = flashcard_store.insert_cards(clerk_id, course_name, concept_name, new_flashcards)
+        else:
             update_operation["$push"]["courses.$[course].concepts.$[concept].concept_flashcards"] = {"$each": new_flashcards}
 
-        # Handle new MCQs: Ensure each MCQ has a correct_answer_index, then push
-        if new_mcqs:
-            for mcq in new_mcqs:
-                if 'correct_answer' in mcq and 'possible_answers' in mcq:
-                    try:
-                        mcq['correct_answer_index'] = mcq['possible_answers'].index(mcq['correct_answer'])
-                    except ValueError:
-                        print(f"Correct answer '{mcq['correct_answer']}' not found in possible answers. Skipping this MCQ.")
-                        continue
-                else:
-                    print(f"MCQ is missing 'correct_answer' or 'possible_answers'. Skipping this MCQ.")
+    # Handle new MCQs: Ensure each MCQ has a correct_answer_index, then push
+    if new_mcqs:
+        for mcq in new_mcqs:
+            if 'correct_answer' in mcq and 'possible_answers' in mcq:
+                try:
+                    mcq['correct_answer_index'] = mcq['possible_answers'].index(mcq['correct_answer'])
+                except ValueError:
+                    print(f"Correct answer '{mcq['correct_answer']}' not found in possible answers. Skipping this MCQ.")
                     continue
-            if new_mcqs:  # Only add MCQs if we have valid ones left
-                update_operation["$push"]["courses.$[course].concepts.$[concept].concept_multiple_choice_questions"] = {"$each": new_mcqs}
-
+            else:
+                print(f"MCQ is missing 'correct_answer' or 'possible_answers'. Skipping this MCQ.")
+                continue
+        if new_mcqs:  # Only add MCQs if we have valid ones left
+            update_operation["$push"]["courses.$[course].concepts.$[concept].concept_multiple_choice_questions"] = {"$each": new_mcqs}
+
+    # Drop empty operators, e.g. when the flashcards went to the flashcards collection
+    update_operation = {operator: fields for operator, fields in update_operation.items() if fields}
+    modified_count = 0
+    if update_operation:
         # Execute the update operation with array filters for course and concept
         result = courses_collection.update_one(
             {"clerk_id": clerk_id, "courses.course_name": course_name},
             update_operation,
             array_filters=[{"course.course_name": course_name}, {"concept.concept_name": concept_name}]
         )
+        modified_count = result.modified_count
 
         print(f"Update result: {result.raw_result}")  # Log the result of the operation
 
-        if result.modified_count > 0:
-            print(f"Successfully added new content to concept: {concept_name} in course: {course_name}")
-            return True
-        else:
-            print(f"No changes made to concept: {concept_name} in course: {course_name}")
-            return False
-
-    except Exception as e:
-        print(f"Error adding course concept content: {str(e)}")
-        print(f"Traceback: {traceback.format_exc()}")
+    if modified_count > 0 or cards_added > 0:
+        if new_flashcards:
+            due_queue.queue_cards(clerk_id, course_name, concept_name, new_flashcards)
+        print(f"Successfully added new content to concept: {concept_name} in course: {course_name}")
+        return True
+    else:
+        print(f"No changes made to concept: {concept_name} in course: {course_name}")
         return False
     
+@_records_write("course")
 def delete_course(clerk_id, course_name):
     """
     Delete a course for a user.
@@ -661,8 +1045,12 @@ def delete_course(clerk_id, course_name):
         {"clerk_id": clerk_id},
         {"$pull": {"courses": {"course_name": course_name}}}
     )
+    if flashcard_store.use_flashcard_collection():
+        flashcard_store.delete_cards(clerk_id, course_name)
+    due_queue.dequeue_cards(clerk_id, course_name)
     return result.modified_count > 0
 
+@_records_write("concept")
 def delete_concept(clerk_id, course_name, concept_name):
     """
     Delete a concept from a course for a user.
@@ -680,9 +1068,176 @@ def delete_concept(clerk_id, course_name, concept_name):
         {"clerk_id": clerk_id, "courses.course_name": course_name},
         {"$pull": {"courses.$.concepts": {"concept_name": concept_name}}}
     )
+    if flashcard_store.use_flashcard_collection():
+        flashcard_store.delete_cards(clerk_id, course_name, concept_name)
+    due_queue.dequeue_cards(clerk_id, course_name, concept_name)
     return result.modified_count > 0
 
 
+@_records_write("course")
+def update_course_details(clerk_id, original_course_name, course_name, description, exam_date):
+    """
+    Rename a course and update its description and exam date in place.
+
+    Only the changed fields are written, so the cost does not depend on how many concepts,
+    flashcards and MCQs the course has. The rename is refused atomically if another course
+    already has the new name.
+
+    Args:
+        clerk_id (str): The Clerk ID of the user.
+        original_course_name (str): The current name of the course.
+        course_name (str): The new name of the course.
+        description (str): The new description of the course.
+        exam_date (datetime): The new exam date of the course.
+
+    Returns:
+        bool: True if the course was updated, False if it was not found or the new name is taken.
+    """
+    query = {"clerk_id": clerk_id, "courses.course_name": original_course_name}
+    if course_name != original_course_name:
+        query = {"clerk_id": clerk_id, "$and": [
+            {"courses.course_name": original_course_name},
+            {"courses.course_name": {"$ne": course_name}}
+        ]}
+
+    result = courses_collection.update_one(
+        query,
+        {"$set": {
+            "courses.$[course].course_name": course_name,
+            "courses.$[course].description": description,
+            "courses.$[course].exam_date": exam_date,
+            "courses.$[course].updated_at": datetime.datetime.now()
+        }},
+        array_filters=[{"course.course_name": original_course_name}]
+    )
+    if result.matched_count == 0:
+        return False
+
+    if course_name != original_course_name:
+        if flashcard_store.use_flashcard_collection():
+            flashcard_store.move_cards(clerk_id, original_course_name, course_name)
+        due_queue.rename_queued_cards(clerk_id, original_course_name, course_name)
+    return True
+
+
+def get_course_schedule(clerk_id, course_name):
+    """
+    Retrieve a course's exam date and how many flashcards are scheduled against it.
+
+    Args:
+        clerk_id (str): The Clerk ID of the user.
+        course_name (str): The name of the course.
+
+    Returns:
+        dict or None: The exam_date and flashcard_count, or None if the course is not found.
+    """
+    schedule = _find_course_field(clerk_id, course_name, {
+        "exam_date": "$course.exam_date",
+        "flashcard_count": {"$size": _course_cards("$course")}
+    })
+    if schedule is not None and flashcard_store.use_flashcard_collection():
+        schedule['flashcard_count'] = flashcard_store.count_cards(clerk_id, course_name)
+    return schedule
+
+
+@_records_write("course")
+def reschedule_course_reviews(clerk_id, course_name, exam_date=None):
+    """
+    Recompute the review dates of every flashcard in a course from today to its exam date.
+
+    Cards on the fixed schedule all get the same new review dates, so the whole course is
+    rewritten with one bulk write instead of card by card. Cards scheduled by the
+    spaced-repetition engine keep their state, but are pulled onto the exam day if they
+    were due after it. The user's due queue is rebuilt on its next read.
+
+    Args:
+        clerk_id (str): The Clerk ID of the user.
+        course_name (str): The name of the course.
+        exam_date (datetime or str, optional): The new exam date. Defaults to the stored one.
+
+    Returns:
+        bool: True if any flashcard was rescheduled, False otherwise.
+    """
+    if exam_date is None:
+        exam_date = (get_course_schedule(clerk_id, course_name) or {}).get('exam_date')
+        if not exam_date:
+            return False
+    if isinstance(exam_date, str):
+        exam_date = parse_exam_date(exam_date)
+
+    review_dates = generate_review_dates(datetime.datetime.now(), exam_date)
+    exam_day = exam_date.strftime('%Y-%m-%d')
+
+    if flashcard_store.use_flashcard_collection():
+        modified = flashcard_store.reschedule_cards(clerk_id, course_name, review_dates, exam_day)
+    else:
+        card_path = "courses.$[course].concepts.$[concept].concept_flashcards.$[card]"
+        # Courses made by make_course have no concepts array until their first concept, and
+        # MongoDB refuses array updates through a missing path
+        course_filter = {"course.course_name": course_name, "course.concepts": {"$type": "array"}}
+        concept_filter = {"concept.concept_flashcards": {"$type": "array"}}
+        result = courses_collection.bulk_write([
+            UpdateOne(
+                {"clerk_id": clerk_id, "courses.course_name": course_name},
+                {"$set": {f"{card_path}.review_dates": review_dates}},
+                array_filters=[course_filter, concept_filter, {"card.srs": {"$exists": False}}]
+            ),
+            UpdateOne(
+                {"clerk_id": clerk_id, "courses.course_name": course_name},
+                {"$set": {
+                    f"{card_path}.srs.d": exam_day,
+                    f"{card_path}.review_dates": [exam_day],
+                    f"{card_path}.next_study_date": exam_day
+                }},
+                array_filters=[course_filter, concept_filter, {"card.srs.d": {"$gt": exam_day}}]
+            ),
+        ])
+        modified = result.modified_count
+
+    due_queue.invalidate_due_queue(clerk_id)
+    return modified > 0
+
+
+@_records_write("concept")
+def update_concept_details(clerk_id, course_name, original_concept_name, concept_name, concept_description):
+    """
+    Rename a concept and update its description in place.
+
+    The rename is refused atomically if the course already has a concept with the new name.
+
+    Args:
+        clerk_id (str): The Clerk ID of the user.
+        course_name (str): The name of the course containing the concept.
+        original_concept_name (str): The current name of the concept.
+        concept_name (str): The new name of the concept.
+        concept_description (str): The new description of the concept.
+
+    Returns:
+        bool: True if the concept was updated, False if it was not found or the new name is taken.
+    """
+    concept_match = [{"concepts.concept_name": original_concept_name}]
+    if concept_name != original_concept_name:
+        concept_match.append({"concepts.concept_name": {"$ne": concept_name}})
+
+    result = courses_collection.update_one(
+        {"clerk_id": clerk_id, "courses": {"$elemMatch": {"course_name": course_name, "$and": concept_match}}},
+        {"$set": {
+            "courses.$[course].concepts.$[concept].concept_name": concept_name,
+            "courses.$[course].concepts.$[concept].concept_description": concept_description
+        }},
+        array_filters=[{"course.course_name": course_name}, {"concept.concept_name": original_concept_name}]
+    )
+    if result.matched_count == 0:
+        return False
+
+    if concept_name != original_concept_name:
+        if flashcard_store.use_flashcard_collection():
+            flashcard_store.move_cards(clerk_id, course_name, course_name, original_concept_name, concept_name)
+        due_queue.rename_queued_cards(clerk_id, course_name, course_name, original_concept_name, concept_name)
+    return True
+
+
+@_records_write("card", study=True)
 def update_lastseen(clerk_id, course_name, card_id):
     """
     Update the last seen date of a flashcard.
@@ -695,13 +1250,13 @@ def update_lastseen(clerk_id, course_name, card_id):
     Returns:
         bool: True if the operation was successful, False otherwise.
     """
-    result = courses_collection.update_one(
-        {"clerk_id": clerk_id, "courses.course_name": course_name, "courses.flashcards.id": card_id},
-        {"$set": {"courses.$[course].flashcards.$[card].last_seen": datetime.datetime.now()}},
-        array_filters=[{"course.course_name": course_name}, {"card.id": card_id}]
-    )
-    return result.modified_count > 0
+    update = {"$set": {"last_seen": datetime.datetime.now()}}
+    due_queue.update_queued_card(clerk_id, card_id, update)
+    if flashcard_store.use_flashcard_collection():
+        return flashcard_store.update_card(clerk_id, card_id, update, course_name)
+    return _update_course_card(clerk_id, course_name, card_id, update)
 
+@_records_write("card")
 def edit_flashcard(clerk_id, course_name, card_id, front=None, back=None):
     """
     Edit an existing flashcard.
@@ -716,19 +1271,13 @@ def edit_flashcard(clerk_id, course_name, card_id, front=None, back=None):
     Returns:
         bool: True if the operation was successful, False otherwise.
     """
-    update_fields = {}
-    if front is not None:
-        update_fields["courses.$[course].flashcards.$[card].front"] = front
-    if back is not None:
-        update_fields["courses.$[course].flashcards.$[card].back"] = back
-
-    result = courses_collection.update_one(
-        {"clerk_id": clerk_id, "courses.course_name": course_name, "courses.flashcards.id": card_id},
-        {"$set": update_fields},
-        array_filters=[{"course.course_name": course_name}, {"card.id": card_id}]
-    )
-    return result.modified_count > 0
+    card_fields = {field: value for field, value in (("front", front), ("back", back)) if value is not None}
+    due_queue.update_queued_card(clerk_id, card_id, {"$set": card_fields})
+    if flashcard_store.use_flashcard_collection():
+        return flashcard_store.update_card(clerk_id, card_id, {"$set": card_fields}, course_name)
+    return _update_course_card(clerk_id, course_name, card_id, {"$set": card_fields})
 
+@_records_write("course")
 def edit_note(clerk_id, course_name, notes_name, new_content):
     """
     Edit an existing note.
@@ -749,6 +1298,7 @@ def edit_note(clerk_id, course_name, notes_name, new_content):
     return result.modified_count > 0
 
 
+@_records_write("card", study=True)
 def create_or_update_next_study_date(clerk_id, course_name, card_id, next_study_date):
     """
     Create or update the next study date for a specific flashcard.
@@ -762,12 +1312,10 @@ def create_or_update_next_study_date(clerk_id, course_name, card_id, next_study_
     Returns:
         None
     """
-    result = courses_collection.update_one(
-        {"clerk_id": clerk_id, "courses.course_name": course_name, "courses.flashcards.id": card_id},
-        {"$set": {"courses.$[course].flashcards.$[card].next_study_date": next_study_date}},
-        array_filters=[{"course.course_name": course_name}, {"card.id": card_id}]
-    )
-    return result.modified_count > 0
+    due_queue.update_queued_card(clerk_id, card_id, {"$set": {"next_study_date": next_study_date}})
+    if flashcard_store.use_flashcard_collection():
+        return flashcard_store.update_card(clerk_id, card_id, {"$set": {"next_study_date": next_study_date}}, course_name)
+    return _update_course_card(clerk_id, course_name, card_id, {"$set": {"next_study_date": next_study_date}})
 
 def get_next_study_date(clerk_id, course_name, card_id):
     """
@@ -781,17 +1329,17 @@ def get_next_study_date(clerk_id, course_name, card_id):
     Returns:
         datetime or None: The next study date if found, None otherwise.
     """
-    user_courses = courses_collection.find_one({"clerk_id": clerk_id, "courses.course_name": course_name})
-    if user_courses and 'courses' in user_courses:
-        for course in user_courses['courses']:
-            if course['course_name'] == course_name:
-                for card in course['flashcards']:
-                    if card['id'] == card_id:
-                        return card.get('next_study_date')
+    card = _find_course_card(clerk_id, course_name, card_id)
+    if card:
+        return card.get('next_study_date')
     return None
 
 
 def get_course(clerk_id, course_name):
+    return _cached_read(clerk_id, ("course", course_name.lower()), lambda: _read_course(clerk_id, course_name))
+
+
+def _read_course(clerk_id, course_name):
     print(f"Looking for course with clerk_id={clerk_id} and course_name={course_name}")  # Log the query
     # Query to search inside the 'courses' array
     course_data = courses_collection.find_one({
@@ -807,6 +1355,8 @@ def get_course(clerk_id, course_name):
         # Find the exact course from the array
         course = next((course for course in course_data['courses'] if course['course_name'].lower() == course_name.lower()), None)
         if course:
+            if flashcard_store.use_flashcard_collection():
+                flashcard_store.attach_cards(clerk_id, [course])
             return {
                 'clerk_id': clerk_id,
                 'course_name': course['course_name'],
@@ -835,6 +1385,7 @@ def get_course_exam_date(clerk_id, course_name):
                 return {'exam_date': course_info.get('exam_date', '')}
     return None
     
+@_records_write("course")
 def remove_today_review_dates(clerk_id, course_name):
     """
     Remove today's review date from all flashcards due today in a course.
@@ -846,12 +1397,32 @@ def remove_today_review_dates(clerk_id, course_name):
     Returns:
         bool: True if the operation was successful, False otherwise.
     """
+    due_queue.dequeue_cards(clerk_id, course_name)
+    if flashcard_store.use_flashcard_collection():
+        return flashcard_store.complete_due_reviews(clerk_id, course_name)
+
     today = datetime.datetime.now().date().strftime("%Y-%m-%d")
-    result = courses_collection.update_many(
-        {"clerk_id": clerk_id, "courses.course_name": course_name},
-        {"$pull": {"courses.$[course].flashcards.$[card].review_dates": today}},
-        array_filters=[{"course.course_name": course_name}, {"card.review_dates": today}]
-    )
+    # Cards live on the concepts and, for those added by add_flashcard, on the course itself.
+    # Each path gets its own update, as MongoDB refuses array updates through a missing path
+    result = courses_collection.bulk_write([
+        UpdateOne(
+            {"clerk_id": clerk_id, "courses.course_name": course_name},
+            {"$pull": {"courses.$[course].flashcards.$[card].review_dates": today}},
+            array_filters=[
+                {"course.course_name": course_name, "course.flashcards": {"$type": "array"}},
+                {"card.review_dates": today}
+            ]
+        ),
+        UpdateOne(
+            {"clerk_id": clerk_id, "courses.course_name": course_name},
+            {"$pull": {"courses.$[course].concepts.$[concept].concept_flashcards.$[card].review_dates": today}},
+            array_filters=[
+                {"course.course_name": course_name, "course.concepts": {"$type": "array"}},
+                {"concept.concept_flashcards.review_dates": today},
+                {"card.review_dates": today}
+            ]
+        ),
+    ], ordered=False)
     return result.modified_count > 0
 
 
@@ -866,26 +1437,137 @@ def get_flashcards_with_today_study_date(clerk_id, course_name=None):
     Returns:
         list: A list of flashcards with today's next study date.
     """
-    today = datetime.datetime.now().date().strftime("%Y-%m-%d")
-    query = {"clerk_id": clerk_id}
+    return due_queue.get_due_cards(clerk_id, course_name or None)
 
-    if course_name:
-        query["courses.course_name"] = course_name
 
-    user_courses = courses_collection.find_one(query)
-    flashcards_today = []
+def _find_review_states(clerk_id, course_name, card_ids):
+    """
+    Retrieve the course exam date and the spaced-repetition state of the given cards in one read.
 
-    if user_courses and 'courses' in user_courses:
-        for course in user_courses['courses']:
-            if course_name is None or course['course_name'] == course_name:
-                for concept in course.get('concepts', []):
-                    for card in concept['concept_flashcards']:
-                        if today in card.get('review_dates', []):
-                            flashcards_today.append(card)
+    Args:
+        clerk_id (str): The Clerk ID of the user.
+        course_name (str): The name of the course.
+        card_ids (list): The IDs of the flashcards.
+
+    Returns:
+        tuple: The exam date (or None) and a dictionary of card ID to state (or None).
+    """
+    if flashcard_store.use_flashcard_collection():
+        exam_date = _find_course_field(clerk_id, course_name, "$course.exam_date")
+        return exam_date, flashcard_store.find_card_states(clerk_id, course_name, card_ids)
+
+    value = _find_course_field(clerk_id, course_name, {
+        "exam_date": "$course.exam_date",
+        "cards": {"$map": {
+            "input": {"$filter": {"input": _course_cards("$course"), "as": "card", "cond": {"$in": ["$$card.id", card_ids]}}},
+            "as": "card",
+            "in": {"id": "$$card.id", "srs": "$$card.srs"}
+        }}
+    }) or {}
+    return value.get('exam_date'), {card['id']: card.get('srs') for card in value.get('cards', [])}
 
-    return flashcards_today
 
+def schedule_graded_reviews(clerk_id, course_name, reviews, today=None):
+    """
+    Attach the next spaced-repetition state to every review that carries a grade.
 
+    Args:
+        clerk_id (str): The Clerk ID of the user.
+        course_name (str): The name of the course.
+        reviews (list): Dictionaries with a card_id and an optional grade.
+        today (date, optional): The day of the reviews. Defaults to today.
+
+    Returns:
+        list: The reviews, with an 'srs' state added to the graded ones.
+    """
+    graded = [review for review in reviews if review.get('grade') is not None]
+    if not graded:
+        return reviews
+
+    exam_date, states = _find_review_states(clerk_id, course_name, [review['card_id'] for review in graded])
+    new_states = srs.schedule_reviews(
+        [states.get(review['card_id']) for review in graded],
+        [review['grade'] for review in graded],
+        exam_date=exam_date or None,
+        today=today
+    )
+    new_states_by_id = {review['card_id']: state for review, state in zip(graded, new_states)}
+    return [
+        {**review, "srs": new_states_by_id[review['card_id']]} if review.get('grade') is not None else review
+        for review in reviews
+    ]
+
+
+@_records_write("cards")
+def submit_study_session(clerk_id, course_name, reviews):
+    """
+    Record every card reviewed in a study session in one round trip.
+
+    For each card this does what update_times_seen, update_lastseen, remove_today_review_date
+    and create_or_update_next_study_date do one request at a time. Cards with a grade are
+    rescheduled by the spaced-repetition engine instead: their review dates are replaced by
+    the next due date it computes.
+
+    Args:
+        clerk_id (str): The Clerk ID of the user.
+        course_name (str): The name of the course.
+        reviews (list): Dictionaries with a card_id, an optional grade (0-5) and an optional next_study_date.
+
+    Returns:
+        dict: The number of cards matched and modified.
+    """
+    if not reviews:
+        return {"matched": 0, "modified": 0}
+
+    seen_at = datetime.datetime.now()
+    reviews = schedule_graded_reviews(clerk_id, course_name, reviews, seen_at.date())
+    if flashcard_store.use_flashcard_collection():
+        result = flashcard_store.review_cards(clerk_id, course_name, reviews, seen_at)
+    else:
+        today = seen_at.date().strftime("%Y-%m-%d")
+        # Cards live in their concept's concept_flashcards, or in the course's own flashcards
+        # when added with add_flashcard. Each location gets its own update, guarded on its array
+        # existing, as MongoDB refuses array updates through a missing path. The queries only
+        # match the document when the card is there, so matched counts reviewed cards.
+        operations = []
+        for review in reviews:
+            card_id = review['card_id']
+            locations = (
+                ("courses.$[course].concepts.$[concept].concept_flashcards.$[card]", "concepts.concept_flashcards.id", "concepts",
+                 [{"concept.concept_flashcards.id": card_id}]),
+                ("courses.$[course].flashcards.$[card]", "flashcards.id", "flashcards", []),
+            )
+            for card_path, id_field, array_field, concept_filters in locations:
+                update = {
+                    "$inc": {f"{card_path}.times_seen": 1},
+                    "$set": {f"{card_path}.last_seen": seen_at},
+                    "$pull": {f"{card_path}.review_dates": today},
+                }
+                if review.get('next_study_date') is not None:
+                    update["$set"][f"{card_path}.next_study_date"] = review['next_study_date']
+                if review.get('srs') is not None:
+                    del update["$pull"]
+                    update["$set"].update({
+                        f"{card_path}.srs": review['srs'],
+                        f"{card_path}.review_dates": [review['srs']['d']],
+                        f"{card_path}.next_study_date": review['srs']['d'],
+                    })
+                operations.append(UpdateOne(
+                    {"clerk_id": clerk_id, "courses": {"$elemMatch": {"course_name": course_name, id_field: card_id}}},
+                    update,
+                    array_filters=[
+                        {"course.course_name": course_name, f"course.{array_field}": {"$type": "array"}},
+                        *concept_filters,
+                        {"card.id": card_id}
+                    ]
+                ))
+        result = courses_collection.bulk_write(operations, ordered=False)
+
+    due_queue.dequeue_cards(clerk_id, card_ids=[review['card_id'] for review in reviews])
+    return {"matched": result.matched_count, "modified": result.modified_count}
+
+
+@_records_write("card", study=True)
 def update_times_seen(clerk_id, course_name, card_id):
     """
     Increments the times_seen field for a specific flashcard.
@@ -898,11 +1580,11 @@ def update_times_seen(clerk_id, course_name, card_id):
     Returns:
         None
     """
-    courses_collection.update_one(
-        {"clerk_id": clerk_id, "courses.course_name": course_name, "courses.flashcards.id": card_id},
-        {"$inc": {"courses.$[course].flashcards.$[card].times_seen": 1}},
-        array_filters=[{"course.course_name": course_name}, {"card.id": card_id}]
-    )
+    due_queue.update_queued_card(clerk_id, card_id, {"$inc": {"times_seen": 1}})
+    if flashcard_store.use_flashcard_collection():
+        flashcard_store.update_card(clerk_id, card_id, {"$inc": {"times_seen": 1}}, course_name)
+        return
+    _update_course_card(clerk_id, course_name, card_id, {"$inc": {"times_seen": 1}})
 
 
 def get_times_seen(clerk_id, course_name, card_id):
@@ -917,21 +1599,67 @@ def get_times_seen(clerk_id, course_name, card_id):
     Returns:
         int: The number of times the flashcard has been seen.
     """
-    user_courses = courses_collection.find_one({"clerk_id": clerk_id, "courses.course_name": course_name})
-    if user_courses and 'courses' in user_courses:
-        for course in user_courses['courses']:
-            if course['course_name'] == course_name:
-                for card in course['flashcards']:
-                    if card['id'] == card_id:
-                        return card.get('times_seen', 0)  # Return 0 if not found
+    card = _find_course_card(clerk_id, course_name, card_id)
+    if card:
+        return card.get('times_seen', 0)  # Return 0 if not found
     return 0
 
 
 def get_course_concepts(clerk_id, course_name):
+    return _cached_read(clerk_id, ("concepts", course_name), lambda: _read_course_concepts(clerk_id, course_name))
+
+
+def _read_course_concepts(clerk_id, course_name):
+
+    # The positional projection returns only the matched course instead of every course
+    concepts = courses_collection.find_one(
+        {"clerk_id": clerk_id, "courses.course_name": course_name},
+        {"_id": 0, "courses.$": 1}
+    )
+    if concepts and concepts.get('courses'):
+        course = concepts['courses'][0]
+        if course.get('concepts'):
+            if flashcard_store.use_flashcard_collection():
+                flashcard_store.attach_cards(clerk_id, [course])
+            return course['concepts']
+    return []
 
-    concepts = courses_collection.find_one({"clerk_id": clerk_id, "courses.course_name": course_name})
-    if concepts and 'courses' in concepts:
-        for course in concepts['courses']:
-            if course['course_name'] == course_name and course.get('concepts'):
-                return course['concepts']
-    return []
\ No newline at end of file
+
+def sync_courses(clerk_id, course_revs):
+    """
+    Describe what changed in a user's courses since the revisions a client last synced them at.
+
+    Courses the client does not know yet are sent in full, and so are courses it has no
+    revision for or whose change log is no longer complete. Other courses only carry their
+    changed and deleted concepts and cards, with the latest content of each.
+
+    Args:
+        clerk_id (str): The Clerk ID of the user.
+        course_revs (dict): The revision each course was last synced at, by course name, or None.
+
+    Returns:
+        dict: The delta and the revision it brings each course up to, by course name.
+    """
+    user = courses_collection.find_one({"clerk_id": clerk_id}, {"_id": 0, "rev": 1, "rev_at": 1, "pending_changes": 1}) or {}
+    if user.get('pending_changes'):
+        record_write(clerk_id, [])
+        user = courses_collection.find_one({"clerk_id": clerk_id}, {"_id": 0, "rev": 1, "rev_at": 1}) or {}
+    rev = user.get('rev') or 0
+    current = {course['course_name']: course for course in get_courses(clerk_id)} if user else {}
+
+    # Clients usually sync every course from the same revision, so the log is read once per revision
+    windows = {}
+    for since in set(course_revs.values()):
+        if isinstance(since, int) and 0 <= since <= rev:
+            windows[since] = changes.read_changes(clerk_id, since, rev, user.get('rev_at'))
+
+    synced = {}
+    for course_name in list(course_revs) + [name for name in current if name not in course_revs]:
+        course = current.get(course_name)
+        window = windows.get(course_revs.get(course_name))
+        if window is None or window[2]:
+            synced_rev, entries = rev, [{"changes": None}]
+        else:
+            synced_rev, entries, _ = window
+        synced[course_name] = {"rev": synced_rev, **changes.course_delta(course_name, course, entries)}
+    return {"courses": synced}
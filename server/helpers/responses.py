@@ -0,0 +1,154 @@
+import datetime
+import decimal
+import gzip
+import os
+import threading
+import time
+
+import orjson
+from bson import ObjectId
+from flask import g, request
+from flask.json.provider import JSONProvider
+from werkzeug.http import http_date
+
+# Brotli is only offered to clients when the package is installed; gzip is always available
+try:
+    import brotli
+except ImportError:
+    brotli = None
+
+# Response compression setup
+COMPRESS_MIN_BYTES = int(os.getenv('COMPRESS_MIN_BYTES', '1024'))
+COMPRESS_GZIP_LEVEL = int(os.getenv('COMPRESS_GZIP_LEVEL', '6'))
+COMPRESS_BROTLI_QUALITY = int(os.getenv('COMPRESS_BROTLI_QUALITY', '5'))
+
+_COMPRESSIBLE_MIMETYPES = ('application/json', 'text/plain', 'text/html', 'text/csv')
+
+_route_stats = {}
+_route_stats_lock = threading.Lock()
+
+
+def _default(value):
+    # Types orjson does not serialize itself, written the way Flask's default provider writes them
+    if isinstance(value, ObjectId):
+        return str(value)
+    if isinstance(value, decimal.Decimal):
+        return str(value)
+    if isinstance(value, datetime.date):
+        return http_date(value)
+    if hasattr(value, '__html__'):
+        return str(value.__html__())
+    raise TypeError(f"Object of type {type(value).__name__} is not JSON serializable")
+
+
+class ORJSONProvider(JSONProvider):
+    """
+    A Flask JSON provider backed by orjson.
+
+    The output matches Flask's default provider: keys are sorted, dates are HTTP dates and
+    ObjectIds are strings. The time spent serializing is added to the request's Server-Timing.
+    """
+
+    _options = orjson.OPT_SORT_KEYS | orjson.OPT_NON_STR_KEYS | orjson.OPT_PASSTHROUGH_DATETIME
+
+    def dumps(self, obj, **kwargs):
+        return orjson.dumps(obj, default=_default, option=self._options).decode('utf-8')
+
+    def loads(self, s, **kwargs):
+        return orjson.loads(s)
+
+    def response(self, *args, **kwargs):
+        obj = self._prepare_response_obj(args, kwargs)
+        started = time.perf_counter()
+        body = orjson.dumps(obj, default=_default, option=self._options)
+        g.serialize_seconds = g.get('serialize_seconds', 0) + time.perf_counter() - started
+        return self._app.response_class(body, mimetype='application/json')
+
+
+def _choose_encoding():
+    encodings = ['br', 'gzip'] if brotli is not None else ['gzip']
+    return request.accept_encodings.best_match(encodings)
+
+
+def _compress(body, encoding):
+    if encoding == 'br':
+        return brotli.compress(body, quality=COMPRESS_BROTLI_QUALITY)
+    return gzip.compress(body, compresslevel=COMPRESS_GZIP_LEVEL)
+
+
+def _record_route_stats(endpoint, serialize_seconds, size, compressed_size):
+    with _route_stats_lock:
+        stats = _route_stats.setdefault(endpoint, {
+            'responses': 0, 'serialize_ms': 0.0, 'bytes': 0, 'compressed_responses': 0, 'compressed_bytes': 0,
+        })
+        stats['responses'] += 1
+        stats['serialize_ms'] += serialize_seconds * 1000
+        stats['bytes'] += size
+        if compressed_size is not None:
+            stats['compressed_responses'] += 1
+            stats['compressed_bytes'] += compressed_size
+
+
+def finalize_response(response):
+    """
+    Compress a response for the client and report how long it took to produce.
+
+    Bodies of at least COMPRESS_MIN_BYTES are compressed with brotli or gzip, whichever the
+    client accepts. Streamed responses such as server-sent events, empty responses like 304s
+    and already encoded bodies are passed through. The Server-Timing header carries the
+    serialization and compression time, and per-route totals are kept for response_stats.
+
+    Args:
+        response (Response): The response about to be sent.
+
+    Returns:
+        Response: The same response, compressed when worthwhile.
+    """
+    if response.direct_passthrough or response.is_streamed:
+        return response
+
+    serialize_seconds = g.get('serialize_seconds', 0)
+    timings = [f"serialize;dur={serialize_seconds * 1000:.2f}"]
+    size = response.content_length or 0
+    compressed_size = None
+
+    compressible = (
+        response.status_code not in (204, 304)
+        and 'Content-Encoding' not in response.headers
+        and response.mimetype in _COMPRESSIBLE_MIMETYPES
+    )
+    if compressible:
+        response.vary.add('Accept-Encoding')
+        encoding = _choose_encoding() if size >= COMPRESS_MIN_BYTES else None
+        if encoding:
+            started = time.perf_counter()
+            body = _compress(response.get_data(), encoding)
+            timings.append(f"compress;dur={(time.perf_counter() - started) * 1000:.2f};desc=\"{encoding}\"")
+            response.set_data(body)
+            response.headers['Content-Encoding'] = encoding
+            compressed_size = len(body)
+
+    response.headers.add('Server-Timing', ', '.join(timings))
+    _record_route_stats(request.endpoint or 'unknown', serialize_seconds, size, compressed_size)
+    return response
+
+
+def response_stats():
+    """
+    Return the serialization time and response sizes recorded for each route.
+
+    Returns:
+        dict: Per endpoint, the number of responses, their average serialization time in
+            milliseconds, average size in bytes and average compressed size in bytes.
+    """
+    with _route_stats_lock:
+        return {
+            endpoint: {
+                'responses': stats['responses'],
+                'avg_serialize_ms': round(stats['serialize_ms'] / stats['responses'], 3),
+                'avg_bytes': stats['bytes'] // stats['responses'],
+                'compressed_responses': stats['compressed_responses'],
+                'avg_compressed_bytes': stats['compressed_bytes'] // stats['compressed_responses'] if stats['compressed_responses'] else None,
+            }
+            for endpoint, stats in _route_stats.items()
+        }
@@ -0,0 +1,80 @@
+from .util import parse_exam_date
+import os
+import datetime
+import numpy as np
+
+# Spaced-repetition setup. Each reviewed card carries a compact SM-2 state:
+# {"e": ease factor, "i": interval in days, "r": consecutive successful reviews, "d": next due date}
+SRS_DEFAULT_EASE = float(os.getenv('SRS_DEFAULT_EASE', '2.5'))
+SRS_MINIMUM_EASE = 1.3
+SRS_MAXIMUM_INTERVAL_DAYS = int(os.getenv('SRS_MAXIMUM_INTERVAL_DAYS', '365'))
+
+# Grades follow SM-2: 0-2 means the card was forgotten, 3 hard, 4 good, 5 easy
+SRS_MINIMUM_GRADE = 0
+SRS_MAXIMUM_GRADE = 5
+SRS_PASSING_GRADE = 3
+
+
+def initial_state():
+    return {"e": SRS_DEFAULT_EASE, "i": 0, "r": 0, "d": None}
+
+
+def valid_grade(grade):
+    return isinstance(grade, int) and not isinstance(grade, bool) and SRS_MINIMUM_GRADE <= grade <= SRS_MAXIMUM_GRADE
+
+
+def _to_day(value):
+    if isinstance(value, str):
+        value = parse_exam_date(value)
+    if isinstance(value, datetime.datetime):
+        value = value.date()
+    return value
+
+
+def schedule_reviews(states, grades, exam_date=None, today=None):
+    """
+    Compute the next SM-2 state of every card reviewed in a session in one vectorized pass.
+
+    The exam date is a hard deadline: no card is scheduled after it while it is still ahead.
+
+    Args:
+        states (list): The current state of each card, or None for a card never reviewed.
+        grades (list): The grade given to each card, from 0 to 5.
+        exam_date (datetime or str, optional): The exam date of the course.
+        today (date, optional): The day of the reviews. Defaults to today.
+
+    Returns:
+        list: The new state of each card.
+    """
+    if len(states) == 0:
+        return []
+
+    today = np.datetime64(_to_day(today) or datetime.date.today(), 'D')
+    states = [state or initial_state() for state in states]
+
+    ease = np.array([state.get('e', SRS_DEFAULT_EASE) for state in states], dtype=np.float64)
+    interval = np.array([state.get('i', 0) for state in states], dtype=np.int64)
+    repetitions = np.array([state.get('r', 0) for state in states], dtype=np.int64)
+    grades = np.clip(np.asarray(grades, dtype=np.int64), SRS_MINIMUM_GRADE, SRS_MAXIMUM_GRADE)
+
+    # A passed card moves on to 1 day, then 6 days, then the previous interval times its ease;
+    # a forgotten card starts over
+    passed = grades >= SRS_PASSING_GRADE
+    grown = np.where(repetitions == 0, 1, np.where(repetitions == 1, 6, np.rint(interval * ease)))
+    new_interval = np.clip(np.where(passed, grown, 1), 1, SRS_MAXIMUM_INTERVAL_DAYS).astype(np.int64)
+    new_repetitions = np.where(passed, repetitions + 1, 0)
+
+    misses = SRS_MAXIMUM_GRADE - grades
+    new_ease = np.maximum(SRS_MINIMUM_EASE, ease + 0.1 - misses * (0.08 + misses * 0.02))
+
+    due = today + new_interval
+    if exam_date is not None:
+        exam_day = np.datetime64(_to_day(exam_date), 'D')
+        if exam_day >= today:
+            due = np.minimum(due, exam_day)
+
+    due_dates = np.datetime_as_string(due, unit='D')
+    return [
+        {"e": round(float(e), 2), "i": int(i), "r": int(r), "d": str(d)}
+        for e, i, r, d in zip(new_ease, new_interval, new_repetitions, due_dates)
+    ]
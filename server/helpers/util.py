@@ -1,8 +1,14 @@
 import datetime
 from datetime import datetime, timedelta
+from functools import lru_cache
 import json
 import re
 
+import numpy as np
+
+# Separates pages and slides in extracted text so later stages can split on them
+PAGE_BREAK = "\f"
+
 
 def parse_mc_questions(multiple_choice_questions):
     # Extract the JSON string (ignoring surrounding text)
@@ -25,32 +31,137 @@ def parse_mc_questions(multiple_choice_questions):
         print(f"Failed to decode JSON: {e}")
         return None  # Return None if parsing fails
     
-def generate_review_dates(start_date, exam_date):
+# Fractions of the time until the exam at which a card is reviewed. The last ratio is 1 so the
+# last review falls on the exam day.
+REVIEW_RATIOS = (1/45, 4/45, 9/45, 15/45, 25/45, 34/45, 1)
+
+_REVIEW_RATIOS_ARRAY = np.array(REVIEW_RATIOS)
+
+
+@lru_cache(maxsize=1024)
+def parse_exam_date(exam_date):
+    try:
+        return datetime.strptime(exam_date, '%Y-%m-%d %H:%M:%S')
+    except ValueError:
+        try:
+            return datetime.strptime(exam_date, '%Y-%m-%d')
+        except ValueError:
+            raise ValueError("Invalid exam_date format. Expected 'YYYY-MM-DD' or 'YYYY-MM-DD HH:MM:SS'")
+
+
+def exam_day(exam_date):
+    """
+    Return the day of an exam date as stored on a course.
+
+    make_course stores 'YYYY-MM-DD' strings and update_course stores datetimes, so stored exam
+    dates are only comparable once normalized.
+
+    Args:
+        exam_date (datetime or str or None): The stored exam date.
+
+    Returns:
+        date or None: The day of the exam, or None if it is missing or invalid.
+    """
     if isinstance(exam_date, str):
         try:
-            exam_date = datetime.strptime(exam_date, '%Y-%m-%d %H:%M:%S')
+            exam_date = parse_exam_date(exam_date)
         except ValueError:
-            try:
-                exam_date = datetime.strptime(exam_date, '%Y-%m-%d')
-            except ValueError:
-                raise ValueError("Invalid exam_date format. Expected 'YYYY-MM-DD' or 'YYYY-MM-DD HH:MM:SS'")
+            return None
+    if isinstance(exam_date, datetime):
+        return exam_date.date()
+    return None
+
 
+def _parse_start_date(start_date):
     if isinstance(start_date, str):
-        start_date = datetime.strptime(start_date, '%Y-%m-%d %H:%M:%S')
+        return datetime.strptime(start_date, '%Y-%m-%d %H:%M:%S')
+    return start_date
 
-    total_days = (exam_date - start_date).days
-    review_dates = []
 
-    # Specific ratios for review intervals
-    ratios = [1/45, 4/45, 9/45, 15/45, 25/45, 34/45, 1]  # Last ratio is 1 to ensure the last day is the exam day
+def _parse_dates(start_date, exam_date):
+    if isinstance(exam_date, str):
+        exam_date = parse_exam_date(exam_date)
+    return _parse_start_date(start_date), exam_date
+
 
-    for ratio in ratios:
+@lru_cache(maxsize=4096)
+def _review_schedule(start_day, total_days):
+    # The schedule only depends on the start day and the whole days until the exam: a review
+    # `offset` days after the start is on or before the exam exactly when offset <= total_days.
+    review_dates = []
+    for ratio in REVIEW_RATIOS:
         review_interval = int(ratio * total_days)
-        review_date = start_date + timedelta(days=review_interval)
-        if review_date <= exam_date:
-            review_dates.append(review_date.strftime('%Y-%m-%d'))
+        if review_interval <= total_days:
+            review_dates.append((start_day + timedelta(days=review_interval)).strftime('%Y-%m-%d'))
 
     # Remove duplicates while preserving order
-    unique_review_dates = list(dict.fromkeys(review_dates))
+    return tuple(dict.fromkeys(review_dates))
+
+
+def generate_review_dates(start_date, exam_date):
+    """
+    Spread a card's review dates between the start date and the exam date.
+
+    Results are memoized on the start day and the number of days until the exam.
+
+    Args:
+        start_date (datetime or str): When the card is added.
+        exam_date (datetime or str): The exam date, as a datetime or 'YYYY-MM-DD[ HH:MM:SS]'.
+
+    Returns:
+        list: The review dates as 'YYYY-MM-DD' strings.
+    """
+    start_date, exam_date = _parse_dates(start_date, exam_date)
+    total_days = (exam_date - start_date).days
+    return list(_review_schedule(start_date.date(), total_days))
+
+
+def generate_review_schedules(start_dates, exam_dates):
+    """
+    Compute the review dates of a batch of cards at once.
+
+    Equivalent to calling generate_review_dates on each pair, but the date arithmetic is done
+    with NumPy across the batch and each distinct (start day, days until exam) pair is only
+    turned into date strings once.
+
+    Args:
+        start_dates (list): The start date of each card, or a single start date for all of them.
+        exam_dates (list): The exam date of each card, or a single exam date for all of them.
+
+    Returns:
+        list: A list of review dates per card.
+    """
+    single_start = isinstance(start_dates, (str, datetime))
+    single_exam = isinstance(exam_dates, (str, datetime))
+    if single_start and single_exam:
+        return [generate_review_dates(start_dates, exam_dates)]
+
+    count = len(exam_dates) if single_start else len(start_dates)
+    starts = [start_dates] * count if single_start else start_dates
+    exams = [exam_dates] * count if single_exam else exam_dates
+    if count == 0:
+        return []
+
+    pairs = [_parse_dates(start, exam) for start, exam in zip(starts, exams)]
+    start_times = np.array([start for start, _ in pairs], dtype='datetime64[us]')
+    exam_times = np.array([exam for _, exam in pairs], dtype='datetime64[us]')
+
+    # Whole days until the exam, rounded down like timedelta.days
+    total_days = (exam_times - start_times) // np.timedelta64(1, 'D')
+    start_days = start_times.astype('datetime64[D]')
+
+    keys, inverse = np.unique(
+        np.stack([start_days.astype(np.int64), total_days.astype(np.int64)], axis=1),
+        axis=0,
+        return_inverse=True
+    )
+    inverse = inverse.reshape(-1)
+
+    # int() truncates towards zero, and so does np.trunc
+    unique_totals = keys[:, 1]
+    offsets = np.trunc(_REVIEW_RATIOS_ARRAY[None, :] * unique_totals[:, None]).astype(np.int64)
+    dates = np.datetime_as_string(keys[:, :1].astype('datetime64[D]') + offsets, unit='D')
+    keep = offsets <= unique_totals[:, None]
 
-    return unique_review_dates
\ No newline at end of file
+    schedules = [tuple(dict.fromkeys(row[mask].tolist())) for row, mask in zip(dates, keep)]
+    return [list(schedules[index]) for index in inverse]
@@ -0,0 +1,96 @@
+"""
+Move flashcards out of the courses documents into the flashcards collection.
+
+Every card in courses.concepts.concept_flashcards (and the legacy courses.flashcards) is
+upserted into the flashcards collection, keyed by (clerk_id, id). Cards without an id are
+first given one in the courses document, as backfill_flashcard_ids.py does, so a re-run
+upserts the same cards. Once a user's cards are written, the embedded arrays are emptied.
+Re-running the script is safe.
+
+Pause writes while migrating, then start the server with FLASHCARD_STORAGE=collection.
+
+Usage:
+    python migrate_flashcards.py [--clerk-id ID] [--dry-run] [--keep-embedded]
+"""
+import argparse
+
+from pymongo import ReplaceOne
+
+from backfill_flashcard_ids import backfill_user
+from helpers.flashcards import card_document, ensure_flashcard_indexes, flashcards_collection
+from helpers.mongo import courses_collection, record_write
+
+
+def user_card_documents(user):
+    documents = []
+    for course in user.get('courses', []):
+        course_cards = [(None, card) for card in course.get('flashcards', [])]
+        for concept in course.get('concepts', []):
+            course_cards += [(concept['concept_name'], card) for card in concept.get('concept_flashcards', [])]
+
+        for concept_name, card in course_cards:
+            documents.append(card_document(user['clerk_id'], course['course_name'], concept_name, card))
+    return documents
+
+
+def clear_embedded_cards(user):
+    # Empty the arrays in place instead of rewriting the courses, so other fields are untouched
+    update = {}
+    for course_index, course in enumerate(user.get('courses', [])):
+        if 'flashcards' in course:
+            update[f"courses.{course_index}.flashcards"] = []
+        for concept_index, concept in enumerate(course.get('concepts', [])):
+            if concept.get('concept_flashcards'):
+                update[f"courses.{course_index}.concepts.{concept_index}.concept_flashcards"] = []
+    if update:
+        courses_collection.update_one({"_id": user['_id']}, {"$set": update})
+        record_write(user['clerk_id'])
+
+
+def migrate_user(user, dry_run=False, keep_embedded=False):
+    if not dry_run:
+        # Saved before copying, or --keep-embedded re-runs would copy the id-less cards again
+        backfill_user(user)
+    documents = user_card_documents(user)
+    if dry_run:
+        return len(documents)
+
+    if documents:
+        flashcards_collection.bulk_write([
+            ReplaceOne({"clerk_id": document['clerk_id'], "id": document['id']}, document, upsert=True)
+            for document in documents
+        ], ordered=False)
+    if not keep_embedded:
+        clear_embedded_cards(user)
+    return len(documents)
+
+
+def main():
+    parser = argparse.ArgumentParser(description=__doc__, formatter_class=argparse.RawDescriptionHelpFormatter)
+    parser.add_argument('--clerk-id', help="Only migrate this user")
+    parser.add_argument('--dry-run', action='store_true', help="Count the cards without writing anything")
+    parser.add_argument('--keep-embedded', action='store_true', help="Copy the cards but leave the embedded arrays in place")
+    args = parser.parse_args()
+
+    if not args.dry_run:
+        ensure_flashcard_indexes()
+
+    query = {"clerk_id": args.clerk_id} if args.clerk_id else {}
+    users = 0
+    cards = 0
+    for user in courses_collection.find(query):
+        try:
+            migrated = migrate_user(user, args.dry_run, args.keep_embedded)
+        except Exception as e:
+            print(f"Error migrating flashcards for clerk_id {user.get('clerk_id')}: {e}")
+            continue
+        users += 1
+        cards += migrated
+        print(f"{user.get('clerk_id')}: {migrated} flashcards")
+
+    action = "Would migrate" if args.dry_run else "Migrated"
+    print(f"{action} {cards} flashcards for {users} users")
+
+
+if __name__ == "__main__":
+    main()
@@ -1,8 +1,11 @@
-from flask import Flask, jsonify, request
-import pymongo
+from flask import Flask, Response, jsonify, request
 from dotenv import load_dotenv
 import os
 import sys
+import io
+import hashlib
+import json
+from concurrent.futures import as_completed, TimeoutError as FuturesTimeoutError
 from helpers.mongo import (
     create_user,
     delete_user,
@@ -27,7 +30,8 @@ from helpers.mongo import (
     get_flashcards_with_today_study_date,
     create_or_update_next_study_date,
     update_times_seen,
-    check_premium_status,
+    submit_study_session,
+    get_premium_status,
     update_premium_status,
     add_course_concept_content,
     update_subscription_id,
@@ -35,37 +39,64 @@ from helpers.mongo import (
     remove_today_review_dates,
     get_course,
     get_course_exam_date,
-    get_course_concepts
+    get_course_concepts,
+    count_courses,
+    update_course_details,
+    update_concept_details,
+    get_course_schedule,
+    reschedule_course_reviews,
+    get_course_rev,
+    sync_courses,
+    course_cache_stats
 )
 from helpers.ai import (
-    generate_flashcards,
     generate_notes,
-    generate_mc_questions
+    generate_study_materials,
+    submit_study_materials,
+    stream_notes,
+    GENERATION_TIMEOUT_SECONDS
 )
 from helpers.util import (
-    generate_review_dates
+    generate_review_schedules,
+    exam_day
+)
+from helpers.jobs import (
+    submit_job,
+    get_job
+)
+from helpers.singleflight import SingleFlight
+from helpers import srs
+from helpers.indexes import bootstrap_indexes
+from helpers.due_queue import start_due_queue_rollover
+from helpers.responses import ORJSONProvider, finalize_response, response_stats
+from helpers.db import db, pool_stats
+from helpers.extract import (
+    get_ocr,
+    ocr_cache_stats,
+    process_pdf,
+    process_pptx,
+    process_image_file
 )
-import pytesseract
 from flask_cors import CORS
-import fitz  # PyMuPDF
 from datetime import datetime
 import stripe
-import numpy as np
-import cv2
-from pptx import Presentation
-
-from paddleocr import PaddleOCR
 import logging
 
 app = Flask(__name__)
+# Serialize JSON responses with orjson
+app.json = ORJSONProvider(app)
 # Configure logging
 logging.basicConfig(level=logging.CRITICAL)
 app.logger.setLevel(logging.CRITICAL)
 
-ocr = PaddleOCR(use_angle_cls=True, lang='en')
+# Load the OCR models before the first upload arrives
+get_ocr()
 
+# Create any missing indexes before serving queries that depend on them
+bootstrap_indexes()
 
-pytesseract.pytesseract.tesseract_cmd = os.getenv('TESSERACT_CMD', 'tesseract')
+# Rebuild the due queues of active users every night
+start_due_queue_rollover()
 
 load_dotenv()
 
@@ -73,34 +104,125 @@ load_dotenv()
 #CORS(app, resources={r"/api/*": {"origins": ["https://www.veidaai.com", "http://localhost:3000"]}}, supports_credentials=True)
 CORS(app, origins=["https://www.veidaai.com"], supports_credentials=True)
 #CORS(app, origins=["*"], supports_credentials=True)
-# MongoDB setup
-mongo_uri = os.getenv('MONGO_URI')
-client = pymongo.MongoClient(mongo_uri)
-db = client['VeidaAI']
 
 # Set your Stripe API key
 stripe.api_key = os.getenv('STRIPE_SECRET_KEY')
 endpoint_secret = os.getenv('STRIPE_WEBHOOK_SECRET')
 
+# Background job setup. Jobs are polled with /api/job_status and /api/job_result.
+EXTRACT_TEXT_STAGES = ['extracting_text', 'generating_notes', 'generating_study_materials']
+RESCHEDULE_STAGES = ['rescheduling_reviews']
+# Courses with at least this many flashcards are rescheduled in a background job
+RESCHEDULE_JOB_MIN_FLASHCARDS = int(os.getenv('RESCHEDULE_JOB_MIN_FLASHCARDS', '500'))
+
 @app.before_request
 def log_request_headers():
     print(f"Incoming Headers: {dict(request.headers)}")
 
+
+@app.after_request
+def compress_response(response):
+    return finalize_response(response)
+
+
+@app.route('/api/response_stats', methods=['GET'])
+def route_response_stats():
+    """
+    Reports the average serialization time, size and compressed size of the responses of each route in this worker.
+
+    Returns:
+        tuple: A JSON response containing the statistics by endpoint and HTTP status code 200.
+    """
+    return jsonify(response_stats()), 200
+
+
+@app.route('/api/pool_stats', methods=['GET'])
+def route_pool_stats():
+    """
+    Reports the MongoDB connection pool configuration and event counters of this worker.
+
+    Returns:
+        tuple: A JSON response containing the pool statistics and HTTP status code 200.
+    """
+    return jsonify(pool_stats()), 200
+
+
+@app.route('/api/ocr_cache_stats', methods=['GET'])
+def route_ocr_cache_stats():
+    """
+    Reports the hits and misses of the in-memory and on-disk OCR caches of this worker.
+
+    Returns:
+        tuple: A JSON response containing the statistics by cache tier and HTTP status code 200.
+    """
+    return jsonify(ocr_cache_stats()), 200
+
+
+@app.route('/api/course_cache_stats', methods=['GET'])
+def route_course_cache_stats():
+    """
+    Reports the size, hits and misses of the course read cache of this worker.
+
+    Returns:
+        tuple: A JSON response containing the cache statistics and HTTP status code 200.
+    """
+    return jsonify(course_cache_stats()), 200
+
     
+def courses_etag(clerk_id):
+    # The revision of the user's courses document is bumped on every write, so it versions every course read
+    rev = get_course_rev(clerk_id)
+    return None if rev is None else f"courses-{rev}"
+
+
+def conditional_json(etag, build):
+    """
+    Answer a conditional GET: 304 when the client's If-None-Match has the ETag, the JSON from build() otherwise.
+
+    build() is only called on a mismatch, so an unchanged resource is neither loaded nor serialized.
+
+    Args:
+        etag (str or None): The current version of the resource, or None if it is not versioned.
+        build (callable): Returns the (body, status code) to send.
+
+    Returns:
+        Response: The response, carrying the ETag when it is a 200 or 304.
+    """
+    if etag is not None and request.if_none_match.contains_weak(etag):
+        response = Response(status=304)
+    else:
+        body, status = build()
+        response = jsonify(body)
+        response.status_code = status
+
+    if etag is not None and response.status_code in (200, 304):
+        response.set_etag(etag, weak=True)
+        # Let clients keep the response, but revalidate it on every use
+        response.headers['Cache-Control'] = 'private, no-cache'
+    return response
+
+
 @app.route('/api/get_course', methods=['GET'])
 def get_course_route():
+    """
+    Retrieves a course with its concepts.
+
+    Supports conditional GET: the response carries an ETag, and a request whose If-None-Match
+    has the current one gets a 304 without the course being loaded.
+    """
     clerk_id = request.args.get('clerk_id')
     course_name = request.args.get('course_name')
 
     if not clerk_id or not course_name:
         return jsonify({'error': 'Missing required parameters'}), 400
 
-    course = get_course(clerk_id, course_name)
+    def build():
+        course = get_course(clerk_id, course_name)
+        if course:
+            return {'course': course}, 200
+        return {'error': 'Course not found'}, 404
 
-    if course:
-        return jsonify({'course': course}), 200
-    else:
-        return jsonify({'error': 'Course not found'}), 404
+    return conditional_json(courses_etag(clerk_id), build)
     
 @app.route('/webhook/clerk', methods=['POST'])
 def clerk_webhook():
@@ -251,48 +373,31 @@ def update_course():
     if not all([clerk_id, original_course_name, course_name, description, exam_date]):
         return jsonify({"error": "Missing required fields"}), 400
 
-    # Fetch the existing course data
-    existing_course = db.courses.find_one(
-        {"clerk_id": clerk_id, "courses.course_name": original_course_name},
-        {"courses.$": 1}
-    )
-    if not existing_course or 'courses' not in existing_course:
-        return jsonify({"error": "Course not found"}), 404
-
-    course_data = existing_course['courses'][0]
-
-    # Delete the existing course using the original course name
-    delete_result = delete_course(clerk_id, original_course_name)
-    print(f"Delete result: {delete_result}")  # Add this line
-    if not delete_result:
-        return jsonify({"error": "Failed to delete existing course"}), 500
-
-
-    # Create a new course with the updated content and existing associated data
-    new_course = {
-        "course_name": course_name,
-        "description": description,
-        "exam_date": exam_date,
-        "concepts": course_data.get('concepts', []),
-        "created_at": course_data.get('created_at', datetime.now()),
-        "updated_at": datetime.now()
-    }
-    try:
-        result = db.courses.update_one(
+    # Read the old exam date first: if it changes, every flashcard's review dates are stale
+    schedule = get_course_schedule(clerk_id, original_course_name)
+
+    # Rename and update the course in place; its concepts, flashcards and MCQs are not rewritten
+    if update_course_details(clerk_id, original_course_name, course_name, description, exam_date):
+        response = {"message": "Course updated successfully"}
+        # Compare days: make_course stores the exam date as a string, update_course as a datetime
+        if schedule and exam_day(schedule.get('exam_date')) != exam_date.date():
+            if schedule.get('flashcard_count', 0) >= RESCHEDULE_JOB_MIN_FLASHCARDS:
+                # Large courses are rescheduled in the background; poll /api/job_status with the job_id
+                job = submit_job(run_reschedule_job, RESCHEDULE_STAGES, clerk_id, course_name)
+                response["job_id"] = job.id
+            else:
+                reschedule_course_reviews(clerk_id, course_name, exam_date)
+        return jsonify(response), 200
 
-            {"clerk_id": clerk_id},
-            {"$addToSet": {"courses": new_course}},
-            upsert=True
-        )
-    except pymongo.errors.DuplicateKeyError:
-        return jsonify({"error": "A course with this name already exists."}), 400
+    if not db.courses.count_documents({"clerk_id": clerk_id, "courses.course_name": original_course_name}, limit=1):
+        return jsonify({"error": "Course not found"}), 404
+    return jsonify({"error": "A course with this name already exists."}), 400
 
+def run_reschedule_job(job, clerk_id, course_name):
+    # The exam date is read when the job runs, so the latest of several quick edits wins
+    job.start_stage('rescheduling_reviews')
+    return {"rescheduled": reschedule_course_reviews(clerk_id, course_name)}, 200
 
-    print(f"Update result: {result.raw_result}")  # Add this line
-    if result.modified_count > 0 or result.upserted_id is not None:
-        return jsonify({"message": "Course updated successfully"}), 200
-    else:
-        return jsonify({"error": "Failed to update course"}), 500
 
 @app.route('/api/create_course_concept', methods=['POST'])
 def create_course_concept():
@@ -316,12 +421,11 @@ def create_course_concept():
     except (ValueError, TypeError) as e:
         return jsonify({"error": "Invalid exam date format or type."}), 400
 
-    # Generate review dates based on start date and exam date
-    review_dates = generate_review_dates(start_date, exam_date)
-
     # Add review_dates and times_seen to each flashcard
     try:
-        for flashcard in concept_flashcards:
+        # Generate review dates based on start date and exam date for all cards at once
+        review_schedules = generate_review_schedules(start_date, [exam_date] * len(concept_flashcards))
+        for flashcard, review_dates in zip(concept_flashcards, review_schedules):
             flashcard['review_dates'] = review_dates
             flashcard['times_seen'] = 0
     except Exception as e:
@@ -350,48 +454,14 @@ def update_course_concept():
     if not all([clerk_id, course_name, original_concept_name, concept_name, concept_description]):
         return jsonify({"error": "Missing required fields"}), 400
 
-    # Fetch the existing course with the concept data
-    existing_course = db.courses.find_one(
-        {"clerk_id": clerk_id, "courses.course_name": course_name},
-        {"courses.$": 1}
-    )
+    # Rename and update the concept in place; its flashcards, notes and MCQs are not rewritten
+    if update_concept_details(clerk_id, course_name, original_concept_name, concept_name, concept_description):
+        return jsonify({"message": "Concept updated successfully"}), 200
 
-    if not existing_course or 'courses' not in existing_course:
+    concept_query = {"clerk_id": clerk_id, "courses": {"$elemMatch": {"course_name": course_name, "concepts.concept_name": original_concept_name}}}
+    if not db.courses.count_documents(concept_query, limit=1):
         return jsonify({"error": "Course or concept not found"}), 404
-
-    # Extract the course data
-    course_data = existing_course['courses'][0]
-
-    # Find the existing concept within the course
-    concept_data = next((concept for concept in course_data.get('concepts', []) if concept['concept_name'] == original_concept_name), None)
-    if not concept_data:
-        return jsonify({"error": "Concept not found"}), 404
-
-    # Delete the original concept
-    delete_result = delete_concept(clerk_id, course_name, original_concept_name)
-    if not delete_result:
-        return jsonify({"error": "Failed to delete existing concept"}), 500
-
-    # Prepare the updated concept data
-    updated_concept = {
-        "concept_name": concept_name,
-        "concept_description": concept_description,
-        "concept_flashcards": concept_data.get('concept_flashcards', []),
-        "concept_notes": concept_data.get('concept_notes', []),
-        "concept_multiple_choice_questions": concept_data.get('concept_multiple_choice_questions', []),
-        "review_dates": concept_data.get('review_dates', []),
-    }
-
-    # Add the updated concept back into the course
-    result = db.courses.update_one(
-        {"clerk_id": clerk_id, "courses.course_name": course_name},
-        {"$addToSet": {"courses.$.concepts": updated_concept}}
-    )
-
-    if result.modified_count > 0:
-        return jsonify({"message": "Concept updated successfully"}), 200
-    else:
-        return jsonify({"error": "Failed to update concept"}), 500
+    return jsonify({"error": "A concept with this name already exists."}), 400
 
 @app.route('/api/delete_concept', methods=['DELETE'])
 def route_delete_concept():
@@ -426,12 +496,15 @@ def check_premium_status(clerk_id=None):
             return jsonify({"error": "Missing required parameter: clerk_id"}), 400
 
     print(f"API called with clerk_id: {clerk_id}")  # Add this line
-    user = db.users.find_one({'clerk_id': clerk_id})
-    if not user:
+    is_premium = get_premium_status(clerk_id)
+    if is_premium is None:
         return jsonify({"error": "User not found"}), 404
 
-    print(f"User found: {user}")  # Add this line
-    return jsonify({"premium": user.get('premium', False)})
+    return jsonify({"premium": is_premium})
+
+
+# Identical uploads that arrive while one is being processed share its result
+upload_flight = SingleFlight()
 
 
 @app.route('/api/extract_text', methods=['POST','OPTIONS'])
@@ -441,6 +514,10 @@ def extract_text():
 
     This endpoint accepts a POST request with a file attachment. It attempts to extract text from the file based on its type. Supported file types include PDF, JPG, JPEG, and PNG. The extracted text is then returned in the response.
 
+    When called with the query parameter async=true, the file is handed to the background job pool and the response contains a job_id
+    that can be polled with /api/job_status and /api/job_result. The query parameter regenerate=true bypasses the
+    cache of generated notes, flashcards and MCQs.
+
     Returns:
         tuple: A JSON response containing the extracted text and HTTP status code.
     """
@@ -460,137 +537,232 @@ def extract_text():
     if file_type not in ['pdf', 'jpg', 'jpeg', 'png', 'txt','ppt','pptx']:
         return jsonify({"error": "Unsupported file type"}), 400
 
-    extracted_text = ""
+    regenerate = request.args.get('regenerate', '').lower() in ['1', 'true']
+
+    # Read the bytes up front: they key coalescing, and the request stream is gone once an async job outlives the request
+    file_bytes = file.read()
+    key = upload_key(file_type, file_bytes, regenerate)
+
+    if request.args.get('async', '').lower() in ['1', 'true']:
+        job = submit_job(run_extract_text_job, EXTRACT_TEXT_STAGES, file_type, file_bytes, regenerate, key, key=key)
+        return jsonify({"job_id": job.id, "status": job.status}), 202
 
     try:
-        if file_type == 'pdf':
-            extracted_text = process_pdf(file)
-        elif file_type in ['jpg', 'jpeg', 'png']:
-            extracted_text = process_image_file(file)
-        elif file_type == 'txt':
+        (body, status), shared = upload_flight.do(key, process_upload, file_type, io.BytesIO(file_bytes), regenerate=regenerate)
+        if shared:
+            print(f"Served upload {key} from an identical in-flight upload")
+        return jsonify(body), status
+    except Exception as e:
+        return jsonify({"error": str(e)}), 500
+
+
+@app.route('/api/job_status', methods=['GET'])
+@app.route('/api/extract_text_status', methods=['GET'])
+def route_job_status():
+    """
+    Retrieves the progress of a background job, such as a text extraction or a large reschedule.
+
+    This endpoint accepts a GET request with query parameter job_id. It returns the job status and the status of each stage.
+
+    Returns:
+        tuple: A JSON response containing the job progress and HTTP status code 200, or 404 if the job is not found.
+    """
+    job_id = request.args.get('job_id')
+    if not job_id:
+        return jsonify({"error": "Missing required parameter: job_id"}), 400
+
+    job = get_job(job_id)
+    if not job:
+        return jsonify({"error": "Job not found"}), 404
+
+    return jsonify(job.to_dict()), 200
+
+
+@app.route('/api/job_result', methods=['GET'])
+@app.route('/api/extract_text_result', methods=['GET'])
+def route_job_result():
+    """
+    Retrieves the result of a background job, such as a text extraction or a large reschedule.
+
+    This endpoint accepts a GET request with query parameter job_id. Once the job has finished it returns the body and status code
+    the synchronous endpoint would have returned; while the job is still running it returns 202 with the job progress.
+
+    Returns:
+        tuple: A JSON response containing the job result and HTTP status code.
+    """
+    job_id = request.args.get('job_id')
+    if not job_id:
+        return jsonify({"error": "Missing required parameter: job_id"}), 400
+
+    job = get_job(job_id)
+    if not job:
+        return jsonify({"error": "Job not found"}), 404
+
+    if job.status == 'failed':
+        return jsonify({"error": job.error}), 500
+    if job.status != 'completed':
+        return jsonify(job.to_dict()), 202
+
+    body, status = job.result
+    return jsonify(body), status
+
+
+def upload_key(file_type, file_bytes, regenerate):
+    return f"{file_type}:{int(regenerate)}:{hashlib.sha256(file_bytes).hexdigest()}"
+
+
+def run_extract_text_job(job, file_type, file_bytes, regenerate, key):
+    result, _ = upload_flight.do(key, process_upload, file_type, io.BytesIO(file_bytes), progress=job.start_stage, regenerate=regenerate)
+    return result
+
+
+def process_upload(file_type, file, progress=None, regenerate=False):
+    """
+    Run the extraction and generation pipeline for an uploaded file.
+
+    Args:
+        file_type (str): The lowercase file extension.
+        file (file-like): The uploaded file.
+        progress (callable, optional): Called with the name of each stage as it starts.
+        regenerate (bool): Skip the cache of generated content and call the model again.
+
+    Returns:
+        tuple: The response body and HTTP status code.
+    """
+    progress = progress or (lambda stage: None)
+
+    progress('extracting_text')
+    extracted_text = extract_file_text(file_type, file)
+
+    if not extracted_text or not extracted_text.strip():
+        return {
+            "error": "Sorry, we couldn't detect any text in that file! Try a higher resolution image or a text-based PDF."
+        }, 204
+
+    # Generate content
+    progress('generating_notes')
+    notes = generate_notes(extracted_text, use_cache=not regenerate)
+    progress('generating_study_materials')
+    mc_questions, flashcards = generate_study_materials(notes, use_cache=not regenerate)
+    add_correct_answer_indexes(mc_questions)
+
+    # Check if generated content is empty
+    if not notes and not mc_questions and not flashcards:
+        return {
+            "error": "Sorry, we couldn't generate some content! The text may be unclear. Try using a higher resolution image or a different file."
+        }, 204
+
+    return {"notes": notes, "flashcards": flashcards, "mc_questions": mc_questions}, 200
+
+
+def add_correct_answer_indexes(mc_questions):
+    for mcq in mc_questions:
+        if 'correct_answer' in mcq and 'possible_answers' in mcq:
             try:
-                extracted_text = file.stream.read().decode('utf-8')
-            except UnicodeDecodeError:
-                file.stream.seek(0)
-                extracted_text = file.stream.read().decode('latin-1', errors='ignore')
-        elif file_type in ['ppt','pptx']:
-            extracted_text = process_pptx(file)
-        
-        if not extracted_text.strip():
-            return jsonify({
-                "error": "Sorry, we couldn't detect any text in that file! Try a higher resolution image or a text-based PDF."
-            }), 204
-
-        # Generate content
-        notes = generate_notes(extracted_text)
-        mc_questions = generate_mc_questions(notes)
-
-        for mcq in mc_questions:
-            if 'correct_answer' in mcq and 'possible_answers' in mcq:
-                try:
-                    mcq['correct_answer_index'] = mcq['possible_answers'].index(mcq['correct_answer'])
-                except ValueError:
-                    # Skip this MCQ and continue with the next one
-                    continue
-            else:
-                # Skip this MCQ if it doesn't have 'correct_answer' or 'possible_answers' fields
+                mcq['correct_answer_index'] = mcq['possible_answers'].index(mcq['correct_answer'])
+            except ValueError:
+                # Skip this MCQ and continue with the next one
                 continue
+        else:
+            # Skip this MCQ if it doesn't have 'correct_answer' or 'possible_answers' fields
+            continue
 
-        flashcards = generate_flashcards(notes)
-
-        # Check if generated content is empty
-        if not notes and not mc_questions and not flashcards:
-            return jsonify({
-                "error": "Sorry, we couldn't generate some content! The text may be unclear. Try using a higher resolution image or a different file."
-            }), 204
 
-        return jsonify({"notes": notes, "flashcards": flashcards, "mc_questions": mc_questions}), 200
-    
-    except Exception as e:
-        return jsonify({"error": str(e)}), 500
+@app.route('/api/extract_text_stream', methods=['POST','OPTIONS'])
+def extract_text_stream():
+    """
+    Extracts text from an uploaded file and streams the generated content as server-sent events.
 
+    This endpoint accepts the same POST request as /api/extract_text. The response is a text/event-stream with these events:
+    'stage' as each stage starts, 'notes_delta' for each piece of the notes as it is generated, 'notes' with the complete notes,
+    'flashcards' and 'mc_questions' as each is ready, then 'done'. Failures are reported with an 'error' event.
 
-def process_pdf(file):
-    extracted_text = ""
-    pdf_document = fitz.open(stream=file.read(), filetype="pdf")
+    Returns:
+        Response: The event stream, or a JSON error response and HTTP status code.
+    """
+    if request.method == 'OPTIONS':
+        return '',204
 
-    for page in pdf_document:
-        # Extract text directly from the PDF's text layer
-        text = page.get_text()
-        if text.strip():
-            extracted_text += text + "\n"
-        
-        # Extract images from the PDF and apply OCR
-        images = page.get_images(full=True)
-        for img in images:
-            xref = img[0]
-            base_image = pdf_document.extract_image(xref)
-            image_bytes = base_image["image"]
-            image_np = np.frombuffer(image_bytes, np.uint8)
-            image = cv2.imdecode(image_np, cv2.IMREAD_GRAYSCALE)
-
-            # Process the image without resizing
-            extracted_text += process_image(image)
-
-    return extracted_text
-def process_pptx(file):
-    extracted_text = []
-    
-    try:
-        # Open the PowerPoint file
-        presentation = Presentation(file)
-
-        for slide in presentation.slides:
-            # Extract text from each slide
-            for shape in slide.shapes:
-                if shape.has_text_frame:
-                    for paragraph in shape.text_frame.paragraphs:
-                        for run in paragraph.runs:
-                            text = run.text.strip()
-                            if text:
-                                extracted_text.append(text + "\n")
-
-            # Extract images from each slide
-            for shape in slide.shapes:
-                if shape.shape_type == 13:  # Shape is a picture
-                    image_stream = shape.image.blob
-                    image_np = np.frombuffer(image_stream, np.uint8)
-                    image = cv2.imdecode(image_np, cv2.IMREAD_GRAYSCALE)
-
-                    # Process the image using OCR
-                    extracted_text.append(process_image(image))
+    if 'file' not in request.files:
+        return jsonify({"error": "No file part"}), 400
 
-    except Exception as e:
-        print(f"Error processing PowerPoint file: {e}")
-        return None
+    file = request.files['file']
+    if file.filename == '':
+        return jsonify({"error": "No selected file"}), 400
 
-    return "".join(extracted_text)
+    file_type = file.filename.split('.')[-1].lower()
+    if file_type not in ['pdf', 'jpg', 'jpeg', 'png', 'txt','ppt','pptx']:
+        return jsonify({"error": "Unsupported file type"}), 400
 
-def process_image_file(file):
-    image_bytes = file.read()
-    image_np = np.frombuffer(image_bytes, np.uint8)
-    image = cv2.imdecode(image_np, cv2.IMREAD_GRAYSCALE)
-    return process_image(image)
+    regenerate = request.args.get('regenerate', '').lower() in ['1', 'true']
+    file_bytes = file.read()
 
+    return Response(
+        stream_upload(file_type, file_bytes, regenerate),
+        mimetype='text/event-stream',
+        headers={'Cache-Control': 'no-cache', 'X-Accel-Buffering': 'no'}
+    )
 
-def process_image(image):
-    if image is None:
-        raise ValueError("Failed to decode the image. The file might be corrupted or the format might not be supported.")
 
-    image = cv2.copyMakeBorder(image, 10, 10, 10, 10, cv2.BORDER_CONSTANT, value=[255, 255, 255])
-    image = cv2.convertScaleAbs(image, alpha=2.0, beta=0)
-    _, image = cv2.threshold(image, 200, 255, cv2.THRESH_BINARY)
+def server_sent_event(event, data):
+    return f"event: {event}\ndata: {json.dumps(data)}\n\n"
 
-    result = ocr.ocr(image, cls=True)
-    
-    extracted_text = ""
-    if result and result[0]:
-        extracted_text = ' '.join([line[1][0] for line in result[0]])
 
-    if not extracted_text.strip():
-        extracted_text = pytesseract.image_to_string(image) + "\n"
+def stream_upload(file_type, file_bytes, regenerate=False):
+    try:
+        yield server_sent_event('stage', {'stage': 'extracting_text'})
+        extracted_text = extract_file_text(file_type, io.BytesIO(file_bytes))
+        if not extracted_text or not extracted_text.strip():
+            yield server_sent_event('error', {
+                "error": "Sorry, we couldn't detect any text in that file! Try a higher resolution image or a text-based PDF."
+            })
+            return
+
+        yield server_sent_event('stage', {'stage': 'generating_notes'})
+        parts = []
+        for delta in stream_notes(extracted_text, use_cache=not regenerate):
+            parts.append(delta)
+            yield server_sent_event('notes_delta', {'delta': delta})
+        notes = "".join(parts)
+        yield server_sent_event('notes', {'notes': notes})
+
+        yield server_sent_event('stage', {'stage': 'generating_study_materials'})
+        futures = submit_study_materials(notes, use_cache=not regenerate)
+        names = {future: name for name, future in futures.items()}
+        try:
+            for future in as_completed(names, timeout=GENERATION_TIMEOUT_SECONDS):
+                result = future.result()
+                if names[future] == 'mc_questions':
+                    add_correct_answer_indexes(result)
+                yield server_sent_event(names[future], {names[future]: result})
+        except FuturesTimeoutError:
+            for future, name in names.items():
+                if not future.done():
+                    print(f"Error: {name} generation timed out after {GENERATION_TIMEOUT_SECONDS} seconds")
+                    future.cancel()
+                    yield server_sent_event(name, {name: []})
+
+        yield server_sent_event('done', {})
+    except Exception as e:
+        print(f"Error streaming upload: {e}")
+        yield server_sent_event('error', {"error": str(e)})
+
+
+def extract_file_text(file_type, file):
+    if file_type == 'pdf':
+        return process_pdf(file)
+    elif file_type in ['jpg', 'jpeg', 'png']:
+        return process_image_file(file)
+    elif file_type == 'txt':
+        try:
+            return file.read().decode('utf-8')
+        except UnicodeDecodeError:
+            file.seek(0)
+            return file.read().decode('latin-1', errors='ignore')
+    elif file_type in ['ppt','pptx']:
+        return process_pptx(file)
+    return ""
 
-    return extracted_text + "\n"
 
 @app.route('/api/create_course', methods=['POST'])
 def route_create_course():
@@ -602,9 +774,8 @@ def route_create_course():
     if not all([clerk_id, course_name, description, exam_date_str]):
         return jsonify({"error": "Missing required fields"}), 400
     
-    is_premium = check_premium_status(clerk_id).json['premium']  # Pass clerk_id as an argument
-    user_courses = get_courses(clerk_id)
-    course_count = len(user_courses)
+    is_premium = get_premium_status(clerk_id) == True
+    course_count = count_courses(clerk_id)
     
     if not is_premium and course_count >= 2:
         return jsonify({"error": "Free users can only create up to 2 courses. Upgrade to premium for unlimited courses."}), 403
@@ -789,17 +960,42 @@ def route_get_courses():
     Retrieves all courses for a user.
 
     This endpoint accepts a GET request with query parameter clerk_id. It returns a list of courses for the specified user.
+    The response carries an ETag; a request whose If-None-Match has the current one gets a 304 instead.
 
     Returns:
-        tuple: A JSON response containing the list of courses and HTTP status code 200.
+        Response: A JSON response containing the list of courses and HTTP status code 200, or an empty 304.
     """
     clerk_id = request.args.get('clerk_id')
 
     if not clerk_id:
         return jsonify({"error": "Missing required parameter: clerk_id"}), 400
 
-    courses = get_courses(clerk_id)
-    return jsonify({"courses": courses}), 200
+    return conditional_json(courses_etag(clerk_id), lambda: ({"courses": get_courses(clerk_id)}, 200))
+
+@app.route('/api/sync', methods=['POST'])
+def route_sync():
+    """
+    Returns only what changed in a user's courses since the client last synced them.
+
+    This endpoint accepts a POST request with JSON data containing the clerk_id and courses, the revision each course
+    the client holds was last synced at ({"course name": rev}; null for a course it has no revision for). Each course in
+    the response carries the revision to send next time and one of: {"deleted": true}, the full "course" (new courses,
+    and courses whose change history is no longer available), or its changed "concepts" and "cards" and the names and
+    IDs of its "deleted_concepts" and "deleted_cards". A course with nothing else listed is unchanged.
+
+    Returns:
+        tuple: A JSON response containing the changes by course name and HTTP status code 200.
+    """
+    data = request.json
+    clerk_id = data.get('clerk_id')
+    course_revs = data.get('courses') or {}
+
+    if not clerk_id or not isinstance(course_revs, dict):
+        return jsonify({"error": "Missing required fields"}), 400
+    if not all(rev is None or (isinstance(rev, int) and not isinstance(rev, bool)) for rev in course_revs.values()):
+        return jsonify({"error": "Course revisions must be integers or null"}), 400
+
+    return jsonify(sync_courses(clerk_id, course_revs)), 200
 
 @app.route('/api/get_course_concepts', methods=['GET'])
 def route_get_course_concepts():
@@ -1027,8 +1223,34 @@ def route_update_times_seen():
     update_times_seen(clerk_id, course_name, card_id)
     return jsonify({"message": "Times seen updated successfully"}), 200
 
-import traceback
-from helpers.ai import generate_mc_questions
+@app.route('/api/submit_study_session', methods=['POST'])
+def route_submit_study_session():
+    """
+    Records every card reviewed in a study session with a single database write.
+
+    This endpoint accepts a POST request with JSON data containing the clerk_id, course_name and
+    results, a list of {"card_id", "grade" (optional, 0-5), "next_study_date" (optional)}. Each card
+    has its times_seen incremented, last_seen set, today's review date removed and its next study
+    date set. A graded card is rescheduled by the spaced-repetition engine instead.
+
+    Returns:
+        tuple: A JSON response with the number of cards matched and updated, and HTTP status code.
+    """
+    data = request.json
+    clerk_id = data.get('clerk_id')
+    course_name = data.get('course_name')
+    results = data.get('results')
+
+    if not all([clerk_id, course_name]) or not isinstance(results, list):
+        return jsonify({"error": "Missing required fields"}), 400
+    if not all(isinstance(result, dict) and result.get('card_id') for result in results):
+        return jsonify({"error": "Every result needs a card_id"}), 400
+    if not all(result.get('grade') is None or srs.valid_grade(result['grade']) for result in results):
+        return jsonify({"error": "Grades must be integers from 0 to 5"}), 400
+
+    counts = submit_study_session(clerk_id, course_name, results)
+    return jsonify({"success": True, **counts}), 200
+
 
 @app.route('/api/add_course_concept_content', methods=['POST'])
 def route_add_course_concept_content():